@@ -13,6 +13,14 @@ def init(width=None, height=None):
         width, height = _get_display_size()
     return screen, width, height
 
+def get_size():
+    """Return the screen size, without opening a window on it"""
+    if os.getenv('DISPLAY'):
+        pygame.display.init()
+    else:
+        _setup_framebuffer_driver()
+    return _get_display_size()
+
 def _setup(width, height):
     pygame.font.init()
     if os.getenv('DISPLAY'):
@@ -0,0 +1,306 @@
+import sys
+import time
+import logging
+import threading
+import pygame
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+logger = logging.getLogger("Raspberry Frame")
+
+# Scaling engines, from fastest to best quality. "box" needs NumPy.
+SCALERS = ("nearest", "twostep", "smooth", "box")
+# "auto" picks the best quality engine expected to take less than this
+AUTO_BUDGET_MS = 250
+
+# Number of scratch surfaces each thread keeps for scaling into, when a
+# photo can't be scaled straight into place
+SCRATCH_SURFACES = 2
+
+# Measured cost of each engine, in ms per source megapixel
+_scaler_costs = {}
+_scaler_costs_lock = threading.Lock()
+_scratch = threading.local()
+
+def load(filename, size):
+    """
+    Load an image that's going to be scaled down to (around) the given size.
+    If PIL is installed, JPEGs are decoded at 1/2, 1/4 or 1/8 resolution
+    where that's still at least the target size, which is much faster and
+    uses much less memory than decoding large photos in full. Where it can,
+    the JPEG is decoded straight into the display's pixel format, so it can
+    be scaled straight into display surfaces.
+    """
+    if Image is not None:
+        try:
+            image = _load_draft(filename, size)
+            if image is not None:
+                return image
+        except Exception as error:
+            logger.debug("Reduced resolution decode failed: %s" % error)
+    return pygame.image.load(filename)
+
+def _load_draft(filename, size):
+    """Decode a JPEG at reduced resolution, or return None if it isn't one"""
+    image = Image.open(filename)
+    if image.format != "JPEG":
+        return None
+    # Picks the smallest DCT scaling that's still at least the size
+    image.draft("RGB", size)
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    display_surface = pygame.display.get_surface()
+    raw_mode = _raw_mode(display_surface)
+    if raw_mode is not None:
+        surface = pygame.Surface(image.size, 0, display_surface)
+        if _contiguous(surface):
+            surface.get_buffer().write(image.tobytes("raw", raw_mode), 0)
+            return surface
+    if hasattr(image, "tobytes"):
+        data = image.tobytes()
+    else:
+        data = image.tostring()
+    return pygame.image.fromstring(data, image.size, "RGB")
+
+def _raw_mode(surface):
+    """
+    Return the PIL raw mode that lays pixels out the same way as the
+    surface, or None if there isn't one (only 32 bit is handled).
+    """
+    if surface is None or surface.get_bitsize() != 32 or sys.byteorder != "little":
+        return None
+    byte_masks = [0xff, 0xff00, 0xff0000, 0xff000000]
+    mode = ["X"] * 4
+    for channel, mask in zip("RGB", surface.get_masks()):
+        if mask not in byte_masks:
+            return None
+        mode[byte_masks.index(mask)] = channel
+    return "".join(mode)
+
+def fit(image, size, crop_threshold, scaler="auto", dest=None):
+    """
+    Return a surface of the given size, in the display's pixel format,
+    containing the image scaled to fit and centred, preserving its aspect
+    ratio. If the image and size aspect ratios differ by less than
+    crop_threshold percent, the image fills the size instead (cropping
+    the edges).
+    If dest is given, it's drawn into that instead of a new surface.
+    """
+    if dest is None:
+        dest = new_surface(size)
+    source_rect, dest_rect = _fit_rects(image.get_size(), size, crop_threshold)
+
+    # Only the bars either side of the photo need clearing
+    for bar in _bars(dest.get_rect(), dest_rect):
+        dest.fill(pygame.Color("BLACK"), bar)
+    # Only scale the part of the photo that will be seen, straight into place
+    scale(image.subsurface(source_rect), dest_rect.size, scaler,
+          dest.subsurface(dest_rect))
+    return dest
+
+def new_surface(size):
+    """Return a new surface in the display's pixel format, if there is one"""
+    display_surface = pygame.display.get_surface()
+    if display_surface is not None:
+        return pygame.Surface(size, 0, display_surface)
+    return pygame.Surface(size)
+
+def _scale_factor(image_size, size, crop_threshold):
+    """Return how much fit() shrinks an image by"""
+    width, height = image_size
+    target_width, target_height = size
+
+    width_scale_factor = 1.0 * width / target_width
+    height_scale_factor = 1.0 * height / target_height
+
+    # Use the largest scale factor, to prevent cropping
+    scale_factor = max(width_scale_factor, height_scale_factor)
+
+    # If the difference in aspect ratios is less than aspect_error,
+    # crop the image instead of letterboxing
+    aspect_error = abs((width_scale_factor - height_scale_factor) /
+                       max(width_scale_factor, height_scale_factor))
+    if aspect_error <= crop_threshold / 100.0:
+        scale_factor = min(width_scale_factor, height_scale_factor)
+    return scale_factor
+
+def _fit_rects(image_size, size, crop_threshold):
+    """
+    Return the part of the image that fit() shows, and where it goes,
+    as (source rect, destination rect).
+    """
+    scale_factor = _scale_factor(image_size, size, crop_threshold)
+    scaled_size = (int(image_size[0] / scale_factor), int(image_size[1] / scale_factor))
+    offset = ((size[0] / 2 - scaled_size[0] / 2),
+              (size[1] / 2 - scaled_size[1] / 2))
+
+    dest_rect = pygame.Rect(offset, scaled_size).clip(pygame.Rect((0, 0), size))
+    source_rect = pygame.Rect((0, 0), image_size)
+    # Work out the crop for whichever side is cropped, if any
+    if dest_rect.width < scaled_size[0]:
+        source_rect.x = int((dest_rect.x - offset[0]) * scale_factor)
+        source_rect.width = int(round(dest_rect.width * scale_factor))
+    if dest_rect.height < scaled_size[1]:
+        source_rect.y = int((dest_rect.y - offset[1]) * scale_factor)
+        source_rect.height = int(round(dest_rect.height * scale_factor))
+    return source_rect.clip(pygame.Rect((0, 0), image_size)), dest_rect
+
+def _bars(rect, inner):
+    """Return the parts of rect that aren't covered by inner"""
+    bars = [pygame.Rect(rect.left, rect.top, rect.width, inner.top - rect.top),
+            pygame.Rect(rect.left, inner.bottom, rect.width, rect.bottom - inner.bottom),
+            pygame.Rect(rect.left, inner.top, inner.left - rect.left, inner.height),
+            pygame.Rect(inner.right, inner.top, rect.right - inner.right, inner.height)]
+    return [bar for bar in bars if bar.width > 0 and bar.height > 0]
+
+def scale(image, size, scaler="auto", dest=None):
+    """
+    Scale the image to the given size, using one of the SCALERS,
+    or "auto" to choose one based on how long they've been taking.
+    If dest is given, the result is drawn into that instead of a new surface.
+    """
+    if scaler == "auto":
+        scaler = _choose_scaler(image)
+    if scaler == "nearest":
+        return _transform(pygame.transform.scale, image, size, dest)
+
+    start = time.time()
+    if scaler == "smooth":
+        result = _transform(pygame.transform.smoothscale, _true_colour(image), size, dest)
+    elif scaler == "twostep":
+        result = _twostep_scale(image, size, dest)
+    elif scaler == "box":
+        result = _box_scale(image, size, dest)
+    else:
+        raise ValueError("Unknown scaler '%s'" % scaler)
+    _record_cost(scaler, image, time.time() - start)
+    return result
+
+def _transform(function, image, size, dest=None):
+    """
+    Scale with one of pygame's transforms. Where it can, the transform writes
+    straight into dest. Otherwise it writes into a scratch surface in the
+    image's format, which is then copied into dest.
+    """
+    if dest is None:
+        return function(image, size)
+    if (image.get_bitsize() == dest.get_bitsize() and
+        image.get_masks() == dest.get_masks() and
+        (function is pygame.transform.scale or _contiguous(dest))):
+        function(image, size, dest)
+    else:
+        scratch = _scratch_surface(size, image)
+        function(image, size, scratch)
+        dest.blit(scratch, (0, 0))
+    return dest
+
+def _scratch_surface(size, image):
+    """
+    Return a surface of the given size, in the image's pixel format, to
+    scale into. They're reused between photos, and each thread has its own.
+    The most recently used are kept, as photos of the same shape scale to
+    the same size.
+    """
+    surfaces = getattr(_scratch, "surfaces", None)
+    if surfaces is None:
+        surfaces = _scratch.surfaces = []
+    key = (tuple(size), image.get_bitsize(), image.get_masks(), image.get_flags())
+    for i, (surface_key, surface) in enumerate(surfaces):
+        if surface_key == key:
+            surfaces.insert(0, surfaces.pop(i))
+            return surface
+    surface = pygame.Surface(size, image.get_flags() & pygame.SRCALPHA, image)
+    surfaces.insert(0, (key, surface))
+    del surfaces[SCRATCH_SURFACES:]
+    return surface
+
+def _contiguous(surface):
+    """
+    smoothscale ignores gaps between rows, so can only write into surfaces
+    (and subsurfaces) whose rows follow straight on from each other.
+    """
+    return surface.get_pitch() == surface.get_width() * surface.get_bytesize()
+
+def _choose_scaler(image):
+    width, height = image.get_size()
+    megapixels = width * height / 1000000.0
+    for scaler in reversed(SCALERS):
+        if scaler == "box" and numpy is None:
+            continue
+        with _scaler_costs_lock:
+            cost = _scaler_costs.get(scaler)
+        # Engines that haven't been measured yet are worth a try
+        if cost is None or cost * megapixels <= AUTO_BUDGET_MS:
+            return scaler
+    return "nearest"
+
+def _record_cost(scaler, image, seconds):
+    width, height = image.get_size()
+    cost = seconds * 1000 / max(width * height / 1000000.0, 0.01)
+    with _scaler_costs_lock:
+        if scaler in _scaler_costs:
+            # Smooth out the odd slow image
+            cost = 0.8 * _scaler_costs[scaler] + 0.2 * cost
+        _scaler_costs[scaler] = cost
+
+def _true_colour(image):
+    """smoothscale only works on 24 and 32 bit surfaces"""
+    if image.get_bitsize() in (24, 32):
+        return image
+    surface = pygame.Surface(image.get_size(), 0, 32)
+    surface.blit(image, (0, 0))
+    return surface
+
+def _twostep_scale(image, size, dest=None):
+    """
+    Cheaply scale down to twice the size with nearest neighbour,
+    then smoothly the rest of the way.
+    """
+    width, height = image.get_size()
+    if width > size[0] * 2 and height > size[1] * 2:
+        image = pygame.transform.scale(image, (size[0] * 2, size[1] * 2))
+    return _transform(pygame.transform.smoothscale, _true_colour(image), size, dest)
+
+def _box_scale(image, size, dest=None):
+    """
+    Average whole blocks of pixels with NumPy, so every source pixel
+    contributes, then smoothly scale the rest of the way.
+    """
+    if numpy is None:
+        raise ValueError("The box scaler needs NumPy")
+    width, height = image.get_size()
+    factor_x = max(width // size[0], 1)
+    factor_y = max(height // size[1], 1)
+    if factor_x > 1 or factor_y > 1:
+        block_width = width // factor_x
+        block_height = height // factor_y
+        # Sum in 16 bits where that can't overflow, to save memory
+        if factor_x * factor_y <= 257:
+            dtype = numpy.uint16
+        else:
+            dtype = numpy.uint32
+        total = numpy.zeros((block_width, block_height, 3), dtype)
+
+        # Add up one pixel from every block at a time, reading the surface's
+        # pixels in place rather than copying the whole photo
+        image = _true_colour(image)
+        pixels = pygame.surfarray.pixels3d(image)
+        try:
+            for x in range(factor_x):
+                for y in range(factor_y):
+                    total += pixels[x:block_width * factor_x:factor_x,
+                                    y:block_height * factor_y:factor_y]
+        finally:
+            # Unlocks the surface
+            del pixels
+        total //= factor_x * factor_y
+        image = pygame.surfarray.make_surface(total.astype(numpy.uint8))
+    return _transform(pygame.transform.smoothscale, _true_colour(image), size, dest)
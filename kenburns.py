@@ -0,0 +1,208 @@
+import time
+import random
+import logging
+import pygame
+
+import imaging
+
+logger = logging.getLogger("Raspberry Frame")
+
+# Extra room around the view in the rescaled buffer, as a fraction of the
+# frame size, so the view can pan between rescales
+MARGIN = 0.05
+# Share of each frame that a rescale may take before a cheaper one is used
+RESCALE_BUDGET = 0.5
+# Weight given to the latest rescale time when averaging
+RESCALE_SMOOTHING = 0.5
+# Cheaper ways to zoom, used in turn when rescaling takes too long.
+# "pan" gives up zooming, and only pans at full resolution.
+RESCALERS = ("smooth", "nearest", "pan")
+
+def source_size(size, zoom):
+    """Return the size photos are scaled to for the given frame size and zoom"""
+    return (int(size[0] * zoom * (1 + MARGIN)), int(size[1] * zoom * (1 + MARGIN)))
+
+class KenBurns:
+    """
+    Slowly pans and zooms across a photo.
+
+    The photo is scaled once to source_size, larger than the frame, and
+    kept. Pans at full resolution are just blits from part of it. To zoom,
+    the region around the view is rescaled into a buffer every rescale_ms
+    (or sooner, if the view pans out of the buffer), and the view pans
+    across the buffer in between. Rescales are timed, and if they don't fit
+    in the frame budget a cheaper scaler is used, until from the next photo
+    on only panning is left.
+    """
+    def __init__(self, size, zoom=1.2, fps=30, rescale_ms=500):
+        self.size = size
+        self.zoom = zoom
+        self.frame_ms = 1000.0 / fps
+        self.rescale_ms = rescale_ms
+        self.source_size = source_size(size, zoom)
+        self.stats = None
+        self.source = None
+
+        self._buffer = imaging.new_surface((int(size[0] * (1 + MARGIN)),
+                                            int(size[1] * (1 + MARGIN))))
+        if self._buffer.get_bitsize() in (24, 32):
+            self.rescaler = "smooth"
+        else:
+            self.rescaler = "nearest"
+        self._rescale_ms = 0
+
+    def start(self, source, duration_ms):
+        """Start moving across a new photo, sized to source_size"""
+        self.source = source
+        self.duration_ms = duration_ms
+        self._elapsed = 0
+        self._region = None
+        self._frame_times = []
+        self._draw_times = []
+        self._rescale_times = []
+
+        width = self.size[0]
+        widest = width * self.zoom
+        if self.rescaler == "pan":
+            motion = "pan"
+        else:
+            motion = random.choice(("in", "out", "pan"))
+        if motion == "in":
+            self._widths = (widest, width)
+        elif motion == "out":
+            self._widths = (width, widest)
+        else:
+            self._widths = (width, width)
+        self._centres = [self._random_centre(crop_width) for crop_width in self._widths]
+
+    def replace_source(self, source):
+        """Carry on the same movement over a better copy of the photo"""
+        self.source = source
+        self._region = None
+
+    def step(self, surface, time_ms):
+        """
+        Draw the next frame onto surface, time_ms after the last one.
+        Returns True once the movement has finished.
+        """
+        self._elapsed = min(self._elapsed + time_ms, self.duration_ms)
+        if time_ms:
+            self._frame_times.append(time_ms)
+
+        start = time.time()
+        width, height = self.size
+        x, y, crop_width = self._view(self._elapsed)
+        if crop_width < width + 0.5:
+            # Full resolution, so just copy the part that's in view
+            self._region = None
+            surface.blit(self.source, (0, 0),
+                         (int(round(x - width / 2.0)), int(round(y - height / 2.0)),
+                          width, height))
+        else:
+            offset = self._buffer_offset(x, y)
+            if offset is None:
+                self._rescale(x, y, crop_width)
+                offset = self._buffer_offset(x, y, clamp=True)
+            surface.blit(self._buffer, (0, 0), offset + (width, height))
+        self._draw_times.append((time.time() - start) * 1000)
+
+        if self._elapsed < self.duration_ms:
+            return False
+        self._report()
+        return True
+
+    def _random_centre(self, crop_width):
+        """Return a random centre that keeps a crop of this width inside the source"""
+        crop_height = crop_width * self.size[1] / self.size[0]
+        return (random.uniform(crop_width / 2.0, self.source_size[0] - crop_width / 2.0),
+                random.uniform(crop_height / 2.0, self.source_size[1] - crop_height / 2.0))
+
+    def _view(self, elapsed):
+        """Return the centre and width of the source in view at the given time"""
+        progress = float(elapsed) / self.duration_ms
+        (x0, y0), (x1, y1) = self._centres
+        width0, width1 = self._widths
+        return (x0 + (x1 - x0) * progress,
+                y0 + (y1 - y0) * progress,
+                width0 + (width1 - width0) * progress)
+
+    def _buffer_offset(self, x, y, clamp=False):
+        """
+        Return where the view is in the rescaled buffer, or None if it needs
+        rescaling first. With clamp, keep it inside the buffer instead.
+        """
+        if not clamp and (self._region is None or self._elapsed >= self._next_rescale):
+            return None
+        region, x_scale, y_scale = self._region
+        left = int(round((x - region.x) * x_scale - self.size[0] / 2.0))
+        top = int(round((y - region.y) * y_scale - self.size[1] / 2.0))
+        max_left = self._buffer.get_width() - self.size[0]
+        max_top = self._buffer.get_height() - self.size[1]
+        if clamp:
+            return min(max(left, 0), max_left), min(max(top, 0), max_top)
+        if not (0 <= left <= max_left and 0 <= top <= max_top):
+            return None
+        return left, top
+
+    def _rescale(self, x, y, crop_width):
+        """Scale the region around the view into the buffer"""
+        start = time.time()
+        buffer_width, buffer_height = self._buffer.get_size()
+        scale = float(self.size[0]) / crop_width
+
+        # Centre between where the view is and where it's heading, so it
+        # stays in the buffer for as long as possible
+        next_x, next_y, _ = self._view(min(self._elapsed + self.rescale_ms, self.duration_ms))
+        region = pygame.Rect(0, 0,
+                             min(int(buffer_width / scale), self.source_size[0]),
+                             min(int(buffer_height / scale), self.source_size[1]))
+        region.center = (int((x + next_x) / 2), int((y + next_y) / 2))
+        view = pygame.Rect(0, 0, int(crop_width), int(crop_width * self.size[1] / self.size[0]))
+        view.center = (int(x), int(y))
+        region.left = min(max(region.left, view.right - region.width), view.left)
+        region.top = min(max(region.top, view.bottom - region.height), view.top)
+        region.clamp_ip(self.source.get_rect())
+
+        # smoothscale mishandles subsurface destinations, so the buffer is
+        # always filled completely
+        source = self.source.subsurface(region)
+        if self.rescaler == "smooth":
+            pygame.transform.smoothscale(source, (buffer_width, buffer_height), self._buffer)
+        else:
+            pygame.transform.scale(source, (buffer_width, buffer_height), self._buffer)
+        self._region = (region, float(buffer_width) / region.width,
+                        float(buffer_height) / region.height)
+        self._next_rescale = self._elapsed + self.rescale_ms
+
+        rescale_ms = (time.time() - start) * 1000
+        self._rescale_times.append(rescale_ms)
+        self._account(rescale_ms)
+
+    def _account(self, rescale_ms):
+        """Switch to a cheaper rescaler if rescaling is taking too long"""
+        self._rescale_ms += RESCALE_SMOOTHING * (rescale_ms - self._rescale_ms)
+
+        if self._rescale_ms > self.frame_ms * RESCALE_BUDGET and self.rescaler != RESCALERS[-1]:
+            self.rescaler = RESCALERS[RESCALERS.index(self.rescaler) + 1]
+            self._rescale_ms = 0
+            logger.info("Ken Burns rescaling is taking %dms, switching to %s" %
+                        (rescale_ms, self.rescaler))
+
+    def _report(self):
+        frame_times = sorted(self._frame_times) or [0]
+        draw_times = sorted(self._draw_times)
+        rescale_times = sorted(self._rescale_times) or [0]
+        frames = len(self._frame_times)
+        self.stats = {"frames": frames,
+                      "late": len([t for t in frame_times if t > self.frame_ms * 1.5]),
+                      "frame_ms_median": frame_times[len(frame_times) / 2],
+                      "frame_ms_max": frame_times[-1],
+                      "draw_ms_median": draw_times[len(draw_times) / 2],
+                      "draw_ms_max": draw_times[-1],
+                      "rescales": len(self._rescale_times),
+                      "rescale_ms_max": rescale_times[-1],
+                      "rescaler": self.rescaler}
+        logger.debug("Ken Burns: %(frames)d frames, %(late)d late, frame time median "
+                     "%(frame_ms_median)dms, max %(frame_ms_max)dms, draw time median "
+                     "%(draw_ms_median).1fms, max %(draw_ms_max).1fms, %(rescales)d "
+                     "rescales (%(rescaler)s), max %(rescale_ms_max).1fms" % self.stats)
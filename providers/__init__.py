@@ -1,3 +1,13 @@
-# TODO: Make this configurable
-import trovebox_provider
-Provider = trovebox_provider.Trovebox
+PROVIDERS = ("trovebox", "local")
+
+def get_provider(name):
+    """Return the provider class with the given name"""
+    # Only import the provider that's used, so the others'
+    # dependencies don't need to be installed
+    if name == "trovebox":
+        import trovebox_provider
+        return trovebox_provider.Trovebox
+    elif name == "local":
+        import local_provider
+        return local_provider.Local
+    raise ValueError("Unknown provider: %s" % name)
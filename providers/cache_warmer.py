@@ -0,0 +1,123 @@
+import time
+import Queue
+import logging
+import threading
+
+logger = logging.getLogger("Raspberry Frame")
+
+# How often to report progress
+PROGRESS_SECONDS = 10
+
+class CacheWarmer:
+    """
+    Fills the photo cache (and optionally the render cache) ahead of time,
+    in the order the slideshow will show the photos, so the slideshow
+    doesn't need the network. Photos that are already cached are skipped,
+    so an interrupted warm-up carries on where it left off when rerun.
+    Stops when the cache is full, rather than evicting photos it has
+    just downloaded.
+    """
+    def __init__(self, provider, workers=2, render=False):
+        self.provider = provider
+        self.workers = workers
+        self.render = render and provider.render_cache is not None
+        self._queue = Queue.Queue(maxsize=workers * 2)
+        self._lock = threading.Lock()
+        self._full = threading.Event()
+        self._in_flight = 0
+        self.checked = 0
+        self.downloaded = 0
+        self.errors = 0
+
+    def run(self):
+        """
+        Warm the cache. Returns False if the photo list couldn't be fetched,
+        or is empty.
+        """
+        logger.info("Fetching photo info...")
+        try:
+            self.provider.wait_for_sync()
+            order = self.provider.get_slideshow_order()
+        except Exception as error:
+            logger.error("Could not fetch photo info: %s" % error)
+            return False
+        logger.info("Warming cache with up to %d photos..." % len(order))
+
+        threads = []
+        for _ in range(self.workers):
+            thread = threading.Thread(target=self._worker)
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+
+        last_progress = time.time()
+        for photo_number in order:
+            if self._full.is_set():
+                break
+            self._queue.put(photo_number)
+            if time.time() - last_progress > PROGRESS_SECONDS:
+                self._report(len(order))
+                last_progress = time.time()
+
+        for _ in threads:
+            self._queue.put(None)
+        for thread in threads:
+            # Join in short steps, so Ctrl-C still works
+            while thread.is_alive():
+                thread.join(1)
+
+        self.provider.photo_cache.save()
+        if self.render:
+            self.provider.render_cache.save()
+        if self._full.is_set():
+            logger.info("Cache is full")
+        self._report(len(order))
+        return True
+
+    def _worker(self):
+        while True:
+            photo_number = self._queue.get()
+            if photo_number is None:
+                return
+            if self._full.is_set():
+                continue
+
+            # Rendering needs the photo too, so stop when the photo cache
+            # is full, but carry on downloading if only the render cache is
+            with self._lock:
+                if self._is_full(self.provider.photo_cache):
+                    self._full.set()
+                    continue
+                render = self.render and not self._is_full(self.provider.render_cache)
+                self._in_flight += 1
+
+            try:
+                downloaded = self.provider.cache_photo(photo_number, render)
+            except Exception as error:
+                logger.debug("Could not cache photo %d: %s" % (photo_number, error))
+                downloaded = False
+                with self._lock:
+                    self.errors += 1
+            with self._lock:
+                self._in_flight -= 1
+                self.checked += 1
+                if downloaded:
+                    self.downloaded += 1
+
+    def _is_full(self, cache):
+        """
+        Return True if another average sized photo wouldn't fit, allowing
+        for the photos the other workers are fetching.
+        """
+        if not len(cache):
+            return False
+        average_bytes = cache.total_bytes() / len(cache)
+        return (cache.total_bytes() + average_bytes * (self._in_flight + 1) >
+                cache.max_bytes)
+
+    def _report(self, total):
+        with self._lock:
+            logger.info("%d/%d photos checked, %d downloaded, %d errors, cache %dMB/%dMB" %
+                        (self.checked, total, self.downloaded, self.errors,
+                         self.provider.photo_cache.total_bytes() / (1024 * 1024),
+                         self.provider.photo_cache.max_bytes / (1024 * 1024)))
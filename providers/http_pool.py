@@ -0,0 +1,152 @@
+import socket
+import httplib
+import logging
+import threading
+import urlparse
+
+logger = logging.getLogger("Raspberry Frame")
+
+MAX_REDIRECTS = 5
+
+# Errors that mean the server couldn't be reached, or the connection failed
+CONNECTION_ERRORS = (socket.error, httplib.HTTPException)
+
+class HTTPError(Exception):
+    """
+    The server sent an error status. This isn't an IOError, as the server
+    was reached - it just doesn't have (or won't give us) the URL.
+    """
+    def __init__(self, status, message):
+        Exception.__init__(self, message)
+        self.status = status
+
+class ConnectionPool:
+    """
+    Pool of persistent (keep-alive) HTTP connections, so that requests to
+    the same host don't each pay for a new TCP and TLS handshake.
+    """
+    def __init__(self, max_connections=2, timeout=30):
+        """
+        max_connections: Maximum number of connections open to each host
+        timeout: Socket timeout in seconds, for connecting and reading
+        """
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._idle = {} # idle connections, keyed by (scheme, host)
+        self._slots = {} # connection semaphores, keyed by (scheme, host)
+
+    def open(self, url):
+        """
+        Request the URL, following any redirects, and return the response.
+        The response must be read to the end or closed, to release the
+        connection back to the pool.
+        """
+        for _ in range(MAX_REDIRECTS + 1):
+            response = self._request(url)
+            if response.status < 300:
+                return response
+
+            # Read the (short) body, so the connection can be reused
+            response.read()
+            response.close()
+            if response.status in (301, 302, 303, 307, 308):
+                url = urlparse.urljoin(url, response.getheader("location"))
+            else:
+                raise HTTPError(response.status, "HTTP Error %d: %s" %
+                                (response.status, response.reason))
+        raise HTTPError(response.status, "Too many redirects: %s" % url)
+
+    def get(self, url):
+        """Request the URL and return the response body"""
+        response = self.open(url)
+        try:
+            return response.read()
+        finally:
+            response.close()
+
+    def _request(self, url):
+        parts = urlparse.urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+
+        slot = self._get_slot(key)
+        slot.acquire()
+        try:
+            connection = self._get_idle(key)
+            if connection is not None:
+                try:
+                    return self._send(key, slot, connection, path)
+                except (httplib.HTTPException, socket.error):
+                    # The server has probably closed the idle connection
+                    logger.debug("Reconnecting to %s..." % parts.netloc)
+                    connection.close()
+            return self._send(key, slot, self._connect(key), path)
+        except:
+            slot.release()
+            raise
+
+    def _send(self, key, slot, connection, path):
+        connection.request("GET", path, headers={"Connection": "keep-alive"})
+        response = connection.getresponse()
+        return _PooledResponse(self, key, slot, connection, response)
+
+    def _connect(self, key):
+        scheme, host = key
+        logger.debug("Connecting to %s..." % host)
+        if scheme == "https":
+            return httplib.HTTPSConnection(host, timeout=self.timeout)
+        return httplib.HTTPConnection(host, timeout=self.timeout)
+
+    def _get_slot(self, key):
+        with self._lock:
+            if key not in self._slots:
+                self._slots[key] = threading.BoundedSemaphore(self.max_connections)
+            return self._slots[key]
+
+    def _get_idle(self, key):
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                return idle.pop()
+            return None
+
+    def _release(self, key, slot, connection, reusable):
+        if reusable:
+            with self._lock:
+                self._idle.setdefault(key, []).append(connection)
+        else:
+            connection.close()
+        slot.release()
+
+class _PooledResponse:
+    """HTTP response that returns its connection to the pool once finished"""
+    def __init__(self, pool, key, slot, connection, response):
+        self._pool = pool
+        self._key = key
+        self._slot = slot
+        self._connection = connection
+        self._response = response
+        self.status = response.status
+        self.reason = response.reason
+
+    def getheader(self, name, default=None):
+        return self._response.getheader(name, default)
+
+    def read(self, amt=None):
+        data = self._response.read(amt)
+        if self._response.isclosed():
+            self.close()
+        return data
+
+    def close(self):
+        if self._connection is None:
+            return
+        # Only reuse the connection if the whole response has been read
+        reusable = self._response.isclosed() and not self._response.will_close
+        if not reusable:
+            self._response.close()
+        self._pool._release(self._key, self._slot, self._connection, reusable)
+        self._connection = None
@@ -0,0 +1,286 @@
+import os
+import sys
+import json
+import stat
+import time
+import hashlib
+import logging
+import sqlite3
+import threading
+from provider import Provider
+from photo_index import PhotoRecord
+
+try:
+    import pyinotify
+except ImportError:
+    pyinotify = None
+
+logger = logging.getLogger("Raspberry Frame")
+
+PHOTO_EXTENSIONS = (".jpg", ".jpeg", ".png", ".gif", ".bmp")
+
+# How often to rescan the photo directory for changes. With inotify this
+# only matters for changes it can't see, such as those made over NFS.
+RESCAN_SECONDS = 10 * 60
+# Wait for a burst of inotify events to finish before rescanning
+INOTIFY_DELAY_SECONDS = 5
+
+class DirectoryIndex:
+    """
+    Persistent index of the photos in a directory tree, numbered from zero
+    so photos can be looked up by index without walking the tree.
+
+    Rescans only list directories whose mtime has changed, which is enough
+    to spot files being added, removed or replaced.
+    """
+    def __init__(self, filename, root):
+        # Use unicode paths, as that's what sqlite expects
+        if not isinstance(root, unicode):
+            root = root.decode(sys.getfilesystemencoding() or "utf-8")
+        self.root = root
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(filename, check_same_thread=False)
+        self._db.execute("PRAGMA case_sensitive_like = ON")
+        self._db.execute("CREATE TABLE IF NOT EXISTS files "
+                         "(idx INTEGER PRIMARY KEY, path TEXT UNIQUE, id TEXT UNIQUE, "
+                         "mtime REAL, size INTEGER, tags TEXT)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS dirs "
+                         "(path TEXT PRIMARY KEY, parent TEXT, mtime REAL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS dirs_parent ON dirs (parent)")
+        self._db.commit()
+        self._count = self._db.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+
+    def get_count(self):
+        return self._count
+
+    def get(self, photo_index):
+        """Return (path, photo ID, tags) for the photo index"""
+        with self._lock:
+            row = self._db.execute("SELECT path, id, tags FROM files WHERE idx=?",
+                                   (photo_index,)).fetchone()
+        if row is None:
+            # Files have been removed since the count was read
+            raise IndexError("Photo index out of range: %d" % photo_index)
+        path, photo_id, tags = row
+        return path, photo_id, json.loads(tags)
+
+    def update_tags(self, photo_id, tags_add, tags_remove):
+        with self._lock:
+            row = self._db.execute("SELECT tags FROM files WHERE id=?",
+                                   (photo_id,)).fetchone()
+            if row is None:
+                raise KeyError("Photo not found: %s" % photo_id)
+            tags = json.loads(row[0])
+            tags = [tag for tag in tags if tag not in tags_remove]
+            tags += [tag for tag in tags_add if tag not in tags]
+            self._db.execute("UPDATE files SET tags=? WHERE id=?",
+                             (json.dumps(tags), photo_id))
+            self._db.commit()
+
+    def scan(self):
+        """Bring the index up to date. Returns True if anything changed."""
+        changed = self._scan_dir("", None)
+        logger.debug("Photo directory scanned, %d photos" % self._count)
+        return changed
+
+    def _scan_dir(self, path, parent):
+        try:
+            mtime = os.stat(os.path.join(self.root, path)).st_mtime
+        except OSError:
+            # Don't empty the index just because a share isn't mounted
+            if not path:
+                raise IOError("Photo directory not found: %s" % self.root)
+            self._remove_dir(path)
+            return True
+
+        with self._lock:
+            row = self._db.execute("SELECT mtime FROM dirs WHERE path=?",
+                                   (path,)).fetchone()
+        changed = row is None or row[0] != mtime
+        if changed:
+            self._update_dir(path, parent, mtime)
+
+        # Subdirectories can change without their parent's mtime changing
+        with self._lock:
+            subdirs = [row[0] for row in self._db.execute(
+                "SELECT path FROM dirs WHERE parent=?", (path,))]
+        for subdir in subdirs:
+            changed = self._scan_dir(subdir, path) or changed
+        return changed
+
+    def _update_dir(self, path, parent, mtime):
+        """List a directory that has changed, and update its entries"""
+        logger.debug("Scanning %s..." % (path or self.root))
+        files = {}
+        subdirs = set()
+        for name in os.listdir(os.path.join(self.root, path)):
+            # Skip names that can't be decoded
+            if not isinstance(name, unicode):
+                continue
+            entry = os.path.join(path, name)
+            try:
+                entry_stat = os.stat(os.path.join(self.root, entry))
+            except OSError:
+                continue
+            if stat.S_ISDIR(entry_stat.st_mode):
+                subdirs.add(entry)
+            elif name.lower().endswith(PHOTO_EXTENSIONS):
+                files[entry] = (entry_stat.st_mtime, entry_stat.st_size)
+
+        with self._lock:
+            indexed = {}
+            for entry, file_mtime, size in self._db.execute(
+                "SELECT path, mtime, size FROM files WHERE path LIKE ? ESCAPE '\\'",
+                (self._like_prefix(path),)).fetchall():
+                # Ignore files in subdirectories
+                if os.path.dirname(entry) == path:
+                    indexed[entry] = (file_mtime, size)
+            for entry in indexed:
+                if entry not in files:
+                    self._remove_file(entry)
+            for entry, (file_mtime, size) in files.iteritems():
+                if entry not in indexed:
+                    self._db.execute("INSERT INTO files VALUES (?, ?, ?, ?, ?, ?)",
+                                     (self._count, entry,
+                                      hashlib.sha1(entry.encode("utf-8")).hexdigest(),
+                                      file_mtime, size, "[]"))
+                    self._count += 1
+                elif indexed[entry] != (file_mtime, size):
+                    # Replaced - give it a new ID, so it isn't loaded from the cache
+                    self._db.execute("UPDATE files SET id=?, mtime=?, size=? WHERE path=?",
+                                     (hashlib.sha1("%s:%s" % (entry.encode("utf-8"), file_mtime)).hexdigest(),
+                                      file_mtime, size, entry))
+
+            known_subdirs = [row[0] for row in self._db.execute(
+                "SELECT path FROM dirs WHERE parent=?", (path,))]
+            self._db.execute("INSERT OR REPLACE INTO dirs VALUES (?, ?, ?)",
+                             (path, parent, mtime))
+            for subdir in subdirs:
+                if subdir not in known_subdirs:
+                    # Scanned when the caller walks this directory's children
+                    self._db.execute("INSERT INTO dirs VALUES (?, ?, NULL)",
+                                     (subdir, path))
+            self._db.commit()
+
+        for subdir in known_subdirs:
+            if subdir not in subdirs:
+                self._remove_dir(subdir)
+
+    def _remove_dir(self, path):
+        with self._lock:
+            logger.debug("Removing %s from index..." % path)
+            for row in self._db.execute(
+                "SELECT path FROM files WHERE path LIKE ? ESCAPE '\\'",
+                (self._like_prefix(path),)).fetchall():
+                self._remove_file(row[0])
+            self._db.execute("DELETE FROM dirs WHERE path=? OR path LIKE ? ESCAPE '\\'",
+                             (path, self._like_prefix(path)))
+            self._db.commit()
+
+    def _remove_file(self, path):
+        """Remove a file, moving the last file into its index to avoid gaps"""
+        idx = self._db.execute("SELECT idx FROM files WHERE path=?",
+                               (path,)).fetchone()[0]
+        self._db.execute("DELETE FROM files WHERE idx=?", (idx,))
+        self._count -= 1
+        self._db.execute("UPDATE files SET idx=? WHERE idx=?", (idx, self._count))
+
+    def _like_prefix(self, path):
+        """Return a LIKE pattern matching everything inside the directory"""
+        if not path:
+            return "%"
+        path = path.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        return os.path.join(path, "%")
+
+class Local(Provider):
+    """Shows photos from a local (or NFS mounted) directory tree"""
+    def __init__(self, width, height, cache_path, *args, **kwds):
+        self.photo_dir = os.path.abspath(kwds.pop("photo_dir"))
+        self._files = DirectoryIndex(cache_path + ".files", self.photo_dir)
+        self._changed = threading.Event()
+        self._scan_lock = threading.Lock()
+        Provider.__init__(self, width, height, cache_path, *args, **kwds)
+
+        if pyinotify is not None:
+            self._watch()
+        self._start_worker(self._scan_worker)
+
+    def _watch(self):
+        """Use inotify to rescan as soon as the directory changes"""
+        changed = self._changed
+        class Handler(pyinotify.ProcessEvent):
+            def process_default(self, event):
+                changed.set()
+
+        watch_manager = pyinotify.WatchManager()
+        mask = (pyinotify.IN_CREATE | pyinotify.IN_DELETE | pyinotify.IN_MOVED_TO |
+                pyinotify.IN_MOVED_FROM | pyinotify.IN_CLOSE_WRITE)
+        notifier = pyinotify.ThreadedNotifier(watch_manager, Handler())
+        notifier.daemon = True
+        notifier.start()
+        watch_manager.add_watch(self.photo_dir, mask, rec=True, auto_add=True)
+
+    def _scan_worker(self):
+        while True:
+            try:
+                if self._scan():
+                    self.request_sync()
+            except Exception as error:
+                logger.error("Could not scan photo directory: %s" % error)
+
+            if self._changed.wait(RESCAN_SECONDS):
+                # Let the changes settle before rescanning
+                time.sleep(INOTIFY_DELAY_SECONDS)
+            self._changed.clear()
+
+    def _scan(self):
+        # Scans happen on both the scan and sync workers
+        with self._scan_lock:
+            return self._files.scan()
+
+    def refresh(self):
+        """Rescan before each sync, so the first sync doesn't find no photos"""
+        self._scan()
+
+    def get_photo_count(self):
+        """Returns the number of photos available to display"""
+        return self._files.get_count()
+
+    def ping(self):
+        """Check that the photo directory is still there (eg. still mounted)"""
+        if not os.path.isdir(self.photo_dir):
+            raise IOError("Photo directory not found: %s" % self.photo_dir)
+
+    def is_offline_error(self, error):
+        # A missing photo has just been deleted, but a missing photo
+        # directory has probably been unmounted
+        return (isinstance(error, EnvironmentError) and
+                not os.path.isdir(self.photo_dir))
+
+    def is_permanent_error(self, error):
+        # The photo has been deleted since its tags were changed
+        return isinstance(error, KeyError)
+
+    def get_photo_object(self, photo_index):
+        """Given a photo index, return a unique object for that photo"""
+        path, photo_id, tags = self._files.get(photo_index)
+        return PhotoRecord(photo_id, os.path.join(self._files.root, path),
+                           os.path.basename(path), tags)
+
+    def get_photo_id(self, photo_object):
+        """Given a photo object, return a unique ID for that photo"""
+        return photo_object.id
+
+    def get_photo_file(self, photo_object):
+        """Given a photo object, return a file handle for the photo"""
+        return open(photo_object.url, "rb")
+
+    def get_description(self, photo_object):
+        return photo_object.description
+
+    def get_tags(self, photo_object):
+        return photo_object.tags
+
+    def update_tags(self, photo_id, tags_add, tags_remove):
+        # There's nowhere else to keep tags, so they're kept in the index
+        self._files.update_tags(photo_id, tags_add, tags_remove)
@@ -0,0 +1,79 @@
+import random
+import hashlib
+
+ROUNDS = 4
+# The domain is made at least this many times the count, so photos can be
+# added without it having to grow
+HEADROOM = 2
+
+class Permutation:
+    """
+    A shuffled ordering of the numbers 0 to count-1, calculated on demand
+    rather than stored, so it takes the same (tiny) amount of memory for
+    any number of photos. The ordering is defined by its seed and count,
+    so it can be saved and restored.
+
+    Numbers are shuffled with a Feistel network, which is a bijection over
+    a power-of-two sized domain. Results outside the count are fed back in
+    until they land inside it ("cycle walking"), which keeps it a bijection
+    over the count. Changing the count only moves the numbers that walked
+    through the changed range, so the ordering mostly survives photos
+    being added, as long as the domain doesn't need to grow. The domain
+    is sized with HEADROOM to make that rare, and its size is part of the
+    ordering, so it needs saving along with the seed and count.
+    """
+    def __init__(self, count, seed=None, shuffle=True, bits=None):
+        """
+        bits: Size of the domain, as returned by the bits attribute.
+              If not given, it's sized for the count.
+        """
+        self.shuffle = shuffle
+        if seed is None:
+            seed = random.getrandbits(32)
+        self.seed = seed
+        if bits is None:
+            bits = self._domain_bits(count)
+        self._set_bits(bits)
+        self.resize(count)
+
+    def resize(self, count):
+        """Change the count, keeping the ordering as far as possible"""
+        self.count = count
+        if count > 1 << self.bits:
+            # Everything moves, but it's rare with the headroom
+            self._set_bits(self._domain_bits(count))
+
+    def _domain_bits(self, count):
+        """Return the bits for a domain with headroom, in two equal halves"""
+        bits = max((count * HEADROOM - 1).bit_length(), 2)
+        return bits + bits % 2
+
+    def _set_bits(self, bits):
+        self.bits = bits
+        self._half_bits = bits // 2
+        self._half_mask = (1 << self._half_bits) - 1
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, position):
+        if not 0 <= position < self.count:
+            raise IndexError("Permutation index out of range")
+        if not self.shuffle:
+            return position
+
+        value = self._feistel(position)
+        while value >= self.count:
+            value = self._feistel(value)
+        return int(value)
+
+    def _feistel(self, value):
+        left = value >> self._half_bits
+        right = value & self._half_mask
+        for round_number in range(ROUNDS):
+            left, right = right, left ^ self._round(round_number, right)
+        return (left << self._half_bits) | right
+
+    def _round(self, round_number, value):
+        digest = hashlib.md5("%d:%d:%d" % (self.seed, round_number, value)).digest()
+        return int(digest[:8].encode("hex"), 16) & self._half_mask
@@ -0,0 +1,142 @@
+import os
+import logging
+import threading
+import collections
+
+logger = logging.getLogger("Raspberry Frame")
+
+# Save the cache state after this many changes
+SAVE_INTERVAL = 10
+
+class PhotoCache:
+    """
+    Keeps track of the files in a cache directory in least-recently-used
+    order, along with their total size, so the cache can be trimmed without
+    scanning the directory. The state is saved to a file alongside the
+    cache, so it survives restarts.
+    """
+    def __init__(self, path, size_mb, state_file):
+        self.path = path
+        self.max_bytes = size_mb * 1024 * 1024
+        self.state_file = state_file
+        self._lock = threading.Lock()
+        self._files = collections.OrderedDict() # sizes, least recently used first
+        self._bytes = 0
+        self._changes = 0
+
+        if not os.path.exists(path):
+            os.makedirs(path)
+        self._load()
+
+    def __contains__(self, name):
+        with self._lock:
+            return name in self._files
+
+    def __len__(self):
+        return len(self._files)
+
+    def filename(self, name):
+        """Return the full path of a cache entry"""
+        return os.path.join(self.path, name)
+
+    def names(self):
+        """Return the cache entries, least recently used first"""
+        with self._lock:
+            return self._files.keys()
+
+    def total_bytes(self):
+        return self._bytes
+
+    def touch(self, name):
+        """Mark the entry as the most recently used"""
+        with self._lock:
+            size = self._files.pop(name)
+            self._files[name] = size
+            self._changed()
+
+    def add(self, name):
+        """
+        Start tracking a file that has just been written to the cache,
+        evicting the least recently used entries if the cache is too big.
+        """
+        size = os.path.getsize(self.filename(name))
+        with self._lock:
+            if name in self._files:
+                self._bytes -= self._files.pop(name)
+            self._files[name] = size
+            self._bytes += size
+
+            # Never evict the entry that was just added
+            while self._bytes > self.max_bytes and len(self._files) > 1:
+                self._evict()
+            self._changed()
+
+    def remove(self, name):
+        """Delete an entry from the cache"""
+        with self._lock:
+            if name in self._files:
+                self._bytes -= self._files.pop(name)
+                self._delete(name)
+                self._changed()
+
+    def _evict(self):
+        name, size = self._files.popitem(last=False)
+        logger.debug("Trimming cache...")
+        self._bytes -= size
+        self._delete(name)
+
+    def _delete(self, name):
+        try:
+            os.remove(self.filename(name))
+        except OSError as error:
+            logger.debug("Could not delete %s: %s" % (name, error))
+
+    def _changed(self):
+        self._changes += 1
+        if self._changes >= SAVE_INTERVAL:
+            self._save()
+
+    def save(self):
+        """Write the cache state to disk"""
+        with self._lock:
+            self._save()
+
+    def _save(self):
+        temp_file = self.state_file + ".part"
+        with open(temp_file, "w") as f:
+            for name, size in self._files.iteritems():
+                f.write("%s %d\n" % (name, size))
+        os.rename(temp_file, self.state_file)
+        self._changes = 0
+
+    def _load(self):
+        """
+        Load the saved cache state, then reconcile it with the files that are
+        actually in the cache. This is the only time the directory is scanned.
+        """
+        saved = collections.OrderedDict()
+        if os.path.exists(self.state_file):
+            with open(self.state_file) as f:
+                for line in f:
+                    name, size = line.rsplit(" ", 1)
+                    saved[name] = int(size)
+
+        names = set(os.listdir(self.path))
+        for name in list(names):
+            # Remove any downloads that didn't complete
+            if name.endswith(".part"):
+                self._delete(name)
+                names.remove(name)
+
+        # Files we don't know about are treated as the least recently used
+        for name in names:
+            if name not in saved:
+                self._files[name] = os.path.getsize(self.filename(name))
+        for name, size in saved.iteritems():
+            if name in names:
+                self._files[name] = size
+
+        self._bytes = sum(self._files.itervalues())
+        while self._bytes > self.max_bytes and self._files:
+            self._evict()
+        self._save()
@@ -0,0 +1,125 @@
+import json
+import sqlite3
+import threading
+
+# Bump this when the photos table changes, to rebuild old indexes
+SCHEMA_VERSION = "2"
+
+class PhotoRecord(object):
+    """The metadata needed to display a single photo"""
+    __slots__ = ("id", "url", "description", "tags", "preview_url")
+
+    def __init__(self, id, url, description, tags, preview_url=None):
+        self.id = id
+        self.url = url
+        self.description = description
+        self.tags = tags
+        self.preview_url = preview_url
+
+    def __eq__(self, other):
+        return (isinstance(other, PhotoRecord) and
+                (self.id, self.url, self.description, self.tags, self.preview_url) ==
+                (other.id, other.url, other.description, other.tags, other.preview_url))
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return "<PhotoRecord id='%s'>" % self.id
+
+class PhotoIndex:
+    """
+    Persistent index of photo records, keyed by photo index.
+    This lets the photo list be navigated from local data after a restart,
+    while the provider syncs any changes in the background.
+    """
+    def __init__(self, filename, key):
+        """
+        The key identifies the provider and the photo size the URLs were
+        requested for. If it doesn't match the stored index, the index is
+        discarded.
+        """
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(filename, check_same_thread=False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS info "
+                         "(key TEXT PRIMARY KEY, value TEXT)")
+        if self._get_info("schema") != SCHEMA_VERSION:
+            self._db.execute("DROP TABLE IF EXISTS photos")
+            self._db.execute("DELETE FROM info")
+            self._set_info("schema", SCHEMA_VERSION)
+        self._db.execute("CREATE TABLE IF NOT EXISTS photos "
+                         "(idx INTEGER PRIMARY KEY, id TEXT, url TEXT, "
+                         "description TEXT, tags TEXT, preview_url TEXT)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS photos_id ON photos (id)")
+        if self._get_info("key") != key:
+            self._db.execute("DELETE FROM photos")
+            self._db.execute("DELETE FROM info")
+            self._set_info("schema", SCHEMA_VERSION)
+            self._set_info("key", key)
+        self._db.commit()
+
+    def _get_info(self, key):
+        row = self._db.execute("SELECT value FROM info WHERE key=?",
+                               (key,)).fetchone()
+        if row is None:
+            return None
+        return row[0]
+
+    def _set_info(self, key, value):
+        self._db.execute("INSERT OR REPLACE INTO info VALUES (?, ?)",
+                         (key, value))
+
+    def get_count(self):
+        """Return the photo count at the last sync, or None if unknown"""
+        with self._lock:
+            count = self._get_info("count")
+        if count is None:
+            return None
+        return int(count)
+
+    def set_count(self, count):
+        """Set the photo count, dropping any records beyond the end"""
+        with self._lock:
+            self._set_info("count", str(count))
+            self._db.execute("DELETE FROM photos WHERE idx >= ?", (count,))
+            self._db.commit()
+
+    def get(self, photo_index):
+        """Return the record at the photo index, or None if it's not indexed"""
+        with self._lock:
+            row = self._db.execute("SELECT id, url, description, tags, preview_url "
+                                   "FROM photos WHERE idx=?",
+                                   (photo_index,)).fetchone()
+        return self._to_record(row)
+
+    def _to_record(self, row):
+        if row is None:
+            return None
+        photo_id, url, description, tags, preview_url = row
+        return PhotoRecord(photo_id, url, description, json.loads(tags), preview_url)
+
+    def get_by_id(self, photo_id):
+        """Return the record with the photo ID, or None if it's not indexed"""
+        with self._lock:
+            row = self._db.execute("SELECT id, url, description, tags, preview_url "
+                                   "FROM photos WHERE id=?",
+                                   (photo_id,)).fetchone()
+        return self._to_record(row)
+
+    def put(self, records):
+        """Store a list of (photo index, record) tuples"""
+        with self._lock:
+            self._db.executemany("INSERT OR REPLACE INTO photos "
+                                 "VALUES (?, ?, ?, ?, ?, ?)",
+                                 [(photo_index, record.id, record.url,
+                                   record.description, json.dumps(record.tags),
+                                   record.preview_url)
+                                  for photo_index, record in records])
+            self._db.commit()
+
+    def set_tags(self, photo_id, tags):
+        """Update the tags for a photo"""
+        with self._lock:
+            self._db.execute("UPDATE photos SET tags=? WHERE id=?",
+                             (json.dumps(tags), photo_id))
+            self._db.commit()
@@ -1,35 +1,118 @@
 import os
+import json
+import mmap
 import random
+import shutil
 import logging
+import tempfile
+import threading
+import Queue
+from cStringIO import StringIO
 import pygame
+import imaging
+from photo_index import PhotoIndex, PhotoRecord
+from photo_cache import PhotoCache
+from tag_queue import TagQueue
+from permutation import Permutation
+from lru_cache import LRUCache
+from http_pool import CONNECTION_ERRORS, HTTPError
 
 logger = logging.getLogger("Raspberry Frame")
 
+# Size of the chunks photos are downloaded in
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+# Number of photo objects to keep in memory
+PHOTO_OBJECT_CACHE_SIZE = 1000
+
+# How often to check the photo index against the provider
+SYNC_INTERVAL_SECONDS = 60 * 60
+# How often to check whether the provider is back, when offline
+OFFLINE_RETRY_SECONDS = 60
+
 class Provider:
     # No standard way of picking an event number, we just need to ensure this is unused
     PROVIDER_EVENT = pygame.USEREVENT + 1
     STAR_TAG = "Starred"
     REMOVE_TAG = "Removed"
 
-    def __init__(self, width, height, cache_path, cache_size_mb, shuffle=True):
+    def __init__(self, width, height, cache_path, cache_size_mb, crop_threshold=10,
+                 shuffle=True, prefetch=0, history=0, render_cache_mb=0, scaler="auto"):
         self.width = width
         self.height = height
+        self.crop_threshold = crop_threshold
+        self.scaler = scaler
         self.cache_path = cache_path
         self.cache_size_mb = cache_size_mb
         self.shuffle = shuffle
-        self.shuffled_photos = []
-        self.cached_photo_objects = {} # keyed by index
-        self.current_photo_number = 0
+        self.shuffled_photos = Permutation(0, shuffle=shuffle)
+        self.cached_photo_objects = LRUCache(PHOTO_OBJECT_CACHE_SIZE) # keyed by index
+        self.current_photo_number = -1
+
+        # Number of photos to load ahead of the current one, and number of
+        # previously shown photos to keep loaded for the back button
+        self.prefetch = prefetch
+        self.history = history
+        self._surfaces = {} # keyed by photo ID
+        self._surface_lock = threading.Lock()
+        # Photos are drawn into these, rather than allocating a new surface
+        # for each one. There's one for each loaded photo, plus the one on
+        # screen and the one being loaded.
+        self._surface_pool = []
+        self._surface_pool_size = prefetch + history + 2
+        # Number of holders (the caller loading it, the loaded photos and
+        # the frame) of each surface in use. Surfaces are only reused once
+        # they've all released them.
+        self._surface_holds = {}
+        self._request_number = 0
+        self._sync_requested = threading.Event()
+
+        # Called from the worker threads after each event is posted,
+        # so the main loop can wake up to handle it
+        self.event_callback = None
+        self._synced = threading.Event()
+        self.sync_error = None
+
+        # When the provider can't be reached, photos are shown from the cache
+        self.offline = False
+        self._offline_photos = []
+        self._offline_photo_number = -1
+
+        # Keep the cache state and index next to the cache, rather than in it,
+        # so they're never trimmed
+        self.photo_cache = PhotoCache(cache_path, cache_size_mb, cache_path + ".lru")
+
+        # Optionally keep photos that have already been scaled to fit the
+        # frame, so they can be shown again without decoding or scaling
+        self.render_cache = None
+        if render_cache_mb:
+            self.render_cache = PhotoCache(cache_path + ".rendered", render_cache_mb,
+                                           cache_path + ".rendered.lru")
+        self.photo_index = PhotoIndex(cache_path + ".index",
+                                      "%s %dx%d" % (self.__class__.__name__,
+                                                    width, height))
+        self.tag_queue = TagQueue(self.update_tags, cache_path + ".tags",
+                                  self.photo_index.set_tags, self.is_permanent_error)
 
-        if not os.path.exists(cache_path):
-            os.makedirs(cache_path)
+        # Carry on the slideshow from where it was last time
+        self._shuffle_file = cache_path + ".shuffle"
+        self._load_shuffle()
+
+        # Photo info is looked up on one worker thread, and the photo file
+        # downloaded and decoded on another. Results are posted back to
+        # the main loop as PROVIDER_EVENTs.
+        self._info_queue = Queue.Queue()
+        self._download_queue = Queue.Queue()
+        self._start_worker(self._info_worker)
+        self._start_worker(self._download_worker)
+        self._start_worker(self._sync_worker)
 
     def get_photo_count(self):
         """Returns the number of photos available to display"""
         raise NotImplementedError("This method must be implemented in the provider class")
 
     def get_photo_object(self, photo_index):
-        """Given a photo index, return a unique object for that photo"""
+        """Given a photo index, return a PhotoRecord for that photo"""
         raise NotImplementedError("This method must be implemented in the provider class")
 
     def get_photo_id(self, photo_object):
@@ -37,9 +120,21 @@ class Provider:
         raise NotImplementedError("This method must be implemented in the provider class")
 
     def get_photo_file(self, photo_object):
-        """Given a photo object, return a file handle for the photo"""
+        """
+        Given a photo object, return a file handle for the photo.
+        The file is read in chunks, then closed.
+        """
         raise NotImplementedError("This method must be implemented in the provider class")
 
+    def get_preview_file(self, photo_object):
+        """
+        Given a photo object, return a file handle for a small preview of the
+        photo, or None if there isn't one. Providers with slow downloads
+        should overload this, so there's something to show while the full
+        photo is on its way.
+        """
+        return None
+
     def get_description(self, photo_object):
         """
         Given a photo object, return its description.
@@ -51,13 +146,66 @@ class Provider:
         """Given a photo object, return its tag list"""
         raise NotImplementedError("This method must be implemented in the provider class")
 
-    def add_tag(self, photo_object, tag):
-        """Add the tag to the specified photo object"""
+    def ping(self):
+        """
+        Check that the provider can be reached, raising an exception if not.
+        Providers should overload this to make sure it isn't answered
+        from cached data.
+        """
+        self.get_photo_count()
+
+    def refresh(self):
+        """
+        Called at the start of each sync, so the photo count and photo
+        objects are fetched afresh. Providers that cache them should
+        overload this.
+        """
+        pass
+
+    def is_offline_error(self, error):
+        """
+        Return True if the error means the provider can't be reached, rather
+        than that something is wrong with a single photo (eg. it's been
+        deleted).
+        """
+        return isinstance(error, CONNECTION_ERRORS)
+
+    def is_permanent_error(self, error):
+        """
+        Return True if the error means a tag update can never succeed
+        (eg. the photo has been deleted), so there's no point retrying it.
+        """
+        return isinstance(error, HTTPError) and 400 <= error.status < 500
+
+    def update_tags(self, photo_id, tags_add, tags_remove):
+        """Add and remove lists of tags for the specified photo ID"""
         raise NotImplementedError("This method must be implemented in the provider class")
 
+    def add_tag(self, photo_object, tag):
+        """
+        Add the tag to the specified photo object.
+        The change is made locally straight away, and sent to the provider
+        in the background.
+        """
+        if tag not in photo_object.tags:
+            photo_object.tags.append(tag)
+            self._tags_changed(photo_object, tag, False, True)
+
     def remove_tag(self, photo_object, tag):
-        """Remove the tag from the specified photo object"""
-        raise NotImplementedError("This method must be implemented in the provider class")
+        """
+        Remove the tag from the specified photo object.
+        The change is made locally straight away, and sent to the provider
+        in the background.
+        """
+        if tag in photo_object.tags:
+            photo_object.tags.remove(tag)
+            self._tags_changed(photo_object, tag, True, False)
+
+    def _tags_changed(self, photo_object, tag, tagged_before, tagged):
+        # Called from the main loop, so the index is updated by the tag
+        # queue's worker, rather than waiting for the disk here
+        self.tag_queue.put(self.get_photo_id(photo_object), tag, tagged_before, tagged,
+                           photo_object.tags)
 
     def _create_event(self, name, **kwargs):
         """
@@ -73,76 +221,579 @@ class Provider:
                             "object": self}))
 
     def _shuffle(self):
-        self.shuffled_photos = range(self.get_photo_count())
         if self.shuffle:
             logger.debug("Shuffling...")
-            random.shuffle(self.shuffled_photos)
+        self.shuffled_photos = Permutation(self._get_photo_count(), shuffle=self.shuffle)
+
+    def _save_shuffle(self):
+        with open(self._shuffle_file, "w") as f:
+            json.dump({"seed": self.shuffled_photos.seed,
+                       "count": len(self.shuffled_photos),
+                       "bits": self.shuffled_photos.bits,
+                       "shuffle": self.shuffle,
+                       "position": self.current_photo_number}, f)
+
+    def _load_shuffle(self):
+        try:
+            with open(self._shuffle_file) as f:
+                state = json.load(f)
+        except (IOError, ValueError):
+            return
+        if state["shuffle"] == self.shuffle:
+            # Files saved before the domain size was saved used a domain
+            # with no headroom, of 2 * ((count - 1).bit_length() + 1) // 2 bits
+            bits = state.get("bits", max((state["count"] - 1).bit_length() + 1, 2) // 2 * 2)
+            self.shuffled_photos = Permutation(state["count"], state["seed"], self.shuffle,
+                                               bits)
+            self.current_photo_number = state["position"]
 
     def get_photo_cached(self, photo_object):
+        """
+        Load a photo, fitted to the frame. The surface is held for the
+        caller, who must pass it to release_surface() once it's finished.
+        """
         # TODO: Check hash, if there's an API for this
         photo_id = self.get_photo_id(photo_object)
-        cache_file = os.path.join(self.cache_path, photo_id)
 
-        if os.path.exists(cache_file):
+        render_name = self._render_name(photo_id)
+        if self.render_cache is not None and render_name in self.render_cache:
+            logger.debug("Loading pre-rendered photo...")
+            self.render_cache.touch(render_name)
+            return self._load_rendered(render_name)
+
+        cache_file = self.photo_cache.filename(photo_id)
+        if photo_id in self.photo_cache:
             logger.debug("Loading photo from cache...")
-            photo_file = cache_file
+            self.photo_cache.touch(photo_id)
         else:
             logger.debug("Downloading photo...")
-            # Save a copy of the photo
-            photo_file = self.get_photo_file(photo_object)
-            with open(cache_file, "wb") as f:
-                f.write(photo_file.read())
-            photo_file.seek(0)
-
-        self.trim_cache()
-
-        image = pygame.image.load(photo_file)
-        image.convert()
-        pygame.event.post(self._create_event("photo", photo_object=photo_object,
-                                             image=image))
-
-    def trim_cache(self):
-        """ Delete photos from the cache until it's below the maximum size """
-        files = [os.path.join(self.cache_path, f) for f in os.listdir(self.cache_path)]
-        cache_bytes = sum([os.path.getsize(f) for f in files])
-        while cache_bytes > self.cache_size_mb * 1024 * 1024:
-            logger.debug("Trimming cache...")
-            filepath = files.pop(0)
-            cache_bytes = cache_bytes - os.path.getsize(filepath)
-            os.remove(filepath)
+            self._download(photo_object, cache_file)
+            self.photo_cache.add(photo_id)
+
+        # Do all the scaling and pixel format conversion here, so the
+        # main loop only has to blit the result
+        image = self._fit(imaging.load(cache_file, (self.width, self.height)))
+
+        if self.render_cache is not None:
+            try:
+                self._save_rendered(render_name, image)
+            except:
+                self.release_surface(image)
+                raise
+        return image
+
+    def _render_name(self, photo_id):
+        # Everything that changes how the photo is rendered
+        return "%s_%dx%d_c%d_%s" % (photo_id, self.width, self.height,
+                                    self.crop_threshold, self.scaler)
+
+    def _is_cached(self, photo_object):
+        """Return True if the photo can be loaded without downloading it"""
+        photo_id = self.get_photo_id(photo_object)
+        if photo_id in self.photo_cache:
+            return True
+        return (self.render_cache is not None and
+                self._render_name(photo_id) in self.render_cache)
+
+    def _load_preview(self, photo_object):
+        """
+        Download and scale up the photo's preview. Returns None if there's
+        no preview.
+        """
+        preview_file = self.get_preview_file(photo_object)
+        if preview_file is None:
+            return None
+        try:
+            # Previews are small, so there's no need to stream them to disk
+            data = preview_file.read()
+        finally:
+            preview_file.close()
+        return self._fit(pygame.image.load(StringIO(data), "preview.jpg"))
+
+    def _fit(self, image):
+        """Fit an image into a surface from the pool, held for the caller"""
+        surface = self._new_surface()
+        try:
+            return imaging.fit(image, (self.width, self.height), self.crop_threshold,
+                               self.scaler, surface)
+        except:
+            self.release_surface(surface)
+            raise
+
+    def _load_rendered(self, render_name):
+        """Map a pre-rendered photo's pixels straight into a surface"""
+        with open(self.render_cache.filename(render_name), "rb") as f:
+            pixels = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            rendered = pygame.image.frombuffer(pixels, (self.width, self.height), "RGBX")
+            image = self._new_surface()
+            try:
+                image.blit(rendered, (0, 0))
+            except:
+                self.release_surface(image)
+                raise
+            del rendered
+        finally:
+            pixels.close()
+        return image
+
+    def _save_rendered(self, render_name, image):
+        render_file = self.render_cache.filename(render_name)
+        handle, temp_file = tempfile.mkstemp(suffix=".part", dir=self.render_cache.path)
+        try:
+            with os.fdopen(handle, "wb") as f:
+                f.write(pygame.image.tostring(image, "RGBX"))
+            os.rename(temp_file, render_file)
+        except:
+            os.remove(temp_file)
+            raise
+        self.render_cache.add(render_name)
+
+    def _download(self, photo_object, cache_file):
+        """
+        Stream the photo into the cache a chunk at a time, so the whole file
+        is never held in memory. The photo is written to a temporary file
+        first, so a failed download never leaves a partial photo in the cache.
+        """
+        photo_file = self.get_photo_file(photo_object)
+        handle, temp_file = tempfile.mkstemp(suffix=".part", dir=self.cache_path)
+        try:
+            with os.fdopen(handle, "wb") as f:
+                shutil.copyfileobj(photo_file, f, DOWNLOAD_CHUNK_SIZE)
+            os.rename(temp_file, cache_file)
+        except:
+            os.remove(temp_file)
+            raise
+        finally:
+            photo_file.close()
 
     def next_photo(self, increment=1):
+        """
+        Request the next photo (or a previous one, if increment is negative).
+        Returns immediately - the photo is posted as a "photo" event once it
+        has been loaded, or an "error" event if something went wrong.
+        If the photo has to be downloaded, a "preview" event may be posted
+        first with a low resolution version. Once an event's image has been
+        shown, it must be passed to release_surface().
+        """
+        self._info_queue.put(increment)
+
+    def _start_worker(self, target):
+        thread = threading.Thread(target=target)
+        thread.daemon = True
+        thread.start()
+
+    def _get_latest(self, queue, block=True):
+        """
+        Return the next request along with any requests that have queued up
+        behind it (oldest first). If block is False and no requests are
+        waiting, return an empty list.
+        """
+        try:
+            requests = [queue.get(block)]
+        except Queue.Empty:
+            return []
+        while True:
+            try:
+                requests.append(queue.get_nowait())
+            except Queue.Empty:
+                return requests
+
+    def _info_worker(self):
+        while True:
+            # Coalesce repeated forward/back requests into a single step,
+            # so we don't look up photos that will never be shown
+            increment = sum(self._get_latest(self._info_queue))
+
+            photo_object = None
+            try:
+                photo_object = self._get_photo_object(increment)
+                self._trim_surfaces()
+
+                # Numbering the requests stops a slow download from
+                # replacing a photo that was requested after it
+                self._request_number += 1
+                image = self._get_surface(photo_object)
+                if image is not None:
+                    logger.debug("Photo already loaded")
+                    self._post_photo(photo_object, image)
+                else:
+                    self._download_queue.put(("show", (self._request_number,
+                                                       photo_object)))
+
+                self._download_queue.put(("prefetch",
+                                          self._get_prefetch_objects()))
+            except Exception as error:
+                if self._go_offline(error):
+                    # Try again from the cache
+                    self._info_queue.put(increment)
+                else:
+                    self._post_error(error, photo_object)
+
+    def _download_worker(self):
+        prefetch = []
+        while True:
+            # Don't block if there are photos waiting to be prefetched
+            requests = self._get_latest(self._download_queue,
+                                        block=not prefetch)
+
+            # Only the most recently requested photo is worth downloading,
+            # and only the most recent prefetch list is still relevant
+            photo_object = None
+            for request, value in requests:
+                if request == "show":
+                    request_number, photo_object = value
+                else:
+                    prefetch = list(value)
+
+            show = photo_object is not None
+            try:
+                if show:
+                    if not self.offline and not self._is_cached(photo_object):
+                        self._show_preview(request_number, photo_object)
+                    image = self._load_surface(photo_object)
+                    if request_number == self._request_number:
+                        self._post_photo(photo_object, image)
+                    else:
+                        self.release_surface(image)
+                elif prefetch:
+                    photo_object = prefetch.pop(0)
+                    if not self._is_loaded(photo_object):
+                        logger.debug("Prefetching photo...")
+                        self.release_surface(self._load_surface(photo_object))
+            except Exception as error:
+                # Only go offline for photos being shown - a prefetch of a
+                # photo that's since been deleted is no reason to
+                if show and self._go_offline(error):
+                    # Show the next photo from the cache instead
+                    self._info_queue.put(+1)
+                elif show:
+                    self._post_error(error, photo_object)
+                else:
+                    # Prefetch failures aren't shown, the photo will be
+                    # retried if it's actually requested
+                    logger.debug("Prefetch failed: %s" % error)
+
+    def _show_preview(self, request_number, photo_object):
+        """Post a "preview" event, to show while the full photo downloads"""
+        try:
+            image = self._load_preview(photo_object)
+        except Exception as error:
+            # Not worth an error, the full photo may still work
+            logger.debug("Preview failed: %s" % error)
+            return
+        if image is None:
+            return
+        if request_number == self._request_number:
+            self._post_event("preview", photo_object=photo_object, image=image)
+        else:
+            self.release_surface(image)
+
+    def _post_photo(self, photo_object, image):
+        self._post_event("photo", photo_object=photo_object, image=image)
+
+    def _post_error(self, error, photo_object=None):
+        if photo_object:
+            error = "Photo ID '%s': %s" % (self.get_photo_id(photo_object),
+                                           error)
+        self._post_event("error", error=error)
+
+    def _post_event(self, name, **kwargs):
+        pygame.event.post(self._create_event(name, **kwargs))
+        if self.event_callback is not None:
+            self.event_callback()
+
+    def _go_offline(self, error):
+        """
+        If the error means the provider can't be reached, switch to showing
+        photos from the cache. Returns True if this happened.
+        """
+        if self.offline or not self.is_offline_error(error):
+            return False
+        logger.error("Provider unreachable, showing cached photos: %s" % error)
+
+        photo_ids = set(self.photo_cache.names())
+        if self.render_cache is not None:
+            suffix = self._render_name("")
+            photo_ids.update(name[:-len(suffix)] for name in self.render_cache.names()
+                             if name.endswith(suffix))
+        if not photo_ids:
+            return False
+
+        self._offline_photos = list(photo_ids)
+        random.shuffle(self._offline_photos)
+        self._offline_photo_number = -1
+        self.offline = True
+        self.request_sync()
+        return True
+
+    def _get_offline_photo_object(self, increment):
+        """Step through the cached photos, and return the photo object"""
+        self._offline_photo_number += increment
+        if self._offline_photo_number < 0:
+            self._offline_photo_number = 0
+        if self._offline_photo_number >= len(self._offline_photos):
+            random.shuffle(self._offline_photos)
+            self._offline_photo_number = 0
+
+        photo_id = self._offline_photos[self._offline_photo_number]
+        logger.debug("Offline photo number %d" % self._offline_photo_number)
+        photo_object = self.photo_index.get_by_id(photo_id)
+        if photo_object is None:
+            photo_object = PhotoRecord(photo_id, None, photo_id, [])
+        return photo_object
+
+    def _get_photo_object(self, increment):
+        """Step through the photo list, and return the (cached) photo object"""
+        if self.offline:
+            return self._get_offline_photo_object(increment)
+
         self.current_photo_number += increment
 
         if self.current_photo_number < 0:
             self.current_photo_number = 0
 
-        # Reshuffle if necessary
-        if (self.current_photo_number >= len(self.shuffled_photos) or
-            self.get_photo_count() != len(self.shuffled_photos)):
+        photo_count = self._get_photo_count()
+        if photo_count != len(self.shuffled_photos):
+            # Photo objects are keyed by index, so only stay valid
+            # while the photo count is unchanged
+            self.cached_photo_objects.clear()
+            # Keep the same ordering, rather than starting again
+            self.shuffled_photos.resize(photo_count)
+
+        # Reshuffle at the end of the list
+        if self.current_photo_number >= len(self.shuffled_photos):
             self._shuffle()
             self.current_photo_number = 0
-            self.cached_photo_objects = {}
 
+        if not self.shuffled_photos:
+            raise Exception("No photos found")
         photo_index = self.shuffled_photos[self.current_photo_number]
+        self._save_shuffle()
 
         logger.debug("Photo number %d (shuffled index %d)" % (self.current_photo_number, photo_index))
 
-        photo_object = None
-        try:
-            # Get the (cached) photo object
-            if photo_index in self.cached_photo_objects:
-                photo_object = self.cached_photo_objects[photo_index]
+        return self._get_photo_object_at(self.current_photo_number)
+
+    def _get_photo_object_at(self, photo_number):
+        """Return the (cached) photo object at a position in the photo list"""
+        photo_index = self.shuffled_photos[photo_number]
+        photo_object = self.cached_photo_objects.get(photo_index)
+        if photo_object is None:
+            photo_object = self.photo_index.get(photo_index)
+            if photo_object is None:
+                photo_object = self._get_provider_photo_object(photo_index)
+                self.photo_index.put([(photo_index, photo_object)])
+            self.cached_photo_objects[photo_index] = photo_object
+        return photo_object
+
+    def _get_provider_photo_object(self, photo_index):
+        """Get a photo object from the provider, including local tag changes"""
+        photo_object = self.get_photo_object(photo_index)
+        photo_object.tags = self.tag_queue.apply(self.get_photo_id(photo_object),
+                                                 photo_object.tags)
+        return photo_object
+
+    def _get_photo_count(self):
+        """Return the photo count, from the photo index if possible"""
+        photo_count = self.photo_index.get_count()
+        if photo_count is None:
+            photo_count = self.get_photo_count()
+            self.photo_index.set_count(photo_count)
+        return photo_count
+
+    def _sync_worker(self):
+        while True:
+            # Don't contact the provider while it's offline,
+            # other than to check whether it's back
+            if self.offline:
+                self._sync_requested.wait(OFFLINE_RETRY_SECONDS)
+                self._sync_requested.clear()
+                try:
+                    self.ping()
+                except Exception as error:
+                    logger.debug("Provider still unreachable: %s" % error)
+                    continue
+                logger.info("Provider is back online")
+                self.offline = False
+
+            try:
+                self._sync_index()
+                self.sync_error = None
+            except Exception as error:
+                logger.error("Could not sync photo index: %s" % error)
+                self.sync_error = error
+            self._synced.set()
+            if self.sync_error is not None and self._go_offline(self.sync_error):
+                continue
+            self._sync_requested.wait(SYNC_INTERVAL_SECONDS)
+            self._sync_requested.clear()
+
+    def request_sync(self):
+        """Sync the photo index now, rather than waiting for the next sync"""
+        self._sync_requested.set()
+
+    def wait_for_sync(self):
+        """
+        Wait until the photo index has been synced with the provider at least
+        once, raising the error if the sync failed.
+        """
+        # Wait in short steps, so Ctrl-C still works
+        while not self._synced.wait(1):
+            pass
+        if self.sync_error is not None:
+            raise self.sync_error
+
+    def get_slideshow_order(self):
+        """
+        Return the positions in the photo list in the order they'll be
+        shown, starting with the current photo.
+        """
+        self._get_photo_object(0)
+        return (range(self.current_photo_number, len(self.shuffled_photos)) +
+                range(self.current_photo_number))
+
+    def cache_photo(self, photo_number, render=False):
+        """
+        Make sure the photo at a position in the photo list is in the photo
+        cache, and optionally in the render cache, without showing it.
+        Returns True if the photo had to be downloaded or rendered.
+        """
+        photo_object = self._get_photo_object_at(photo_number)
+        photo_id = self.get_photo_id(photo_object)
+        if render and self.render_cache is not None:
+            if self._render_name(photo_id) in self.render_cache:
+                return False
+            self.release_surface(self.get_photo_cached(photo_object))
+            return True
+        if photo_id in self.photo_cache:
+            return False
+        self._download(photo_object, self.photo_cache.filename(photo_id))
+        self.photo_cache.add(photo_id)
+        return True
+
+    def _sync_index(self):
+        """Bring the photo index up to date with the provider"""
+        logger.debug("Syncing photo index...")
+        self.refresh()
+        photo_count = self.get_photo_count()
+        self.photo_index.set_count(photo_count)
+
+        changed = []
+        for photo_index in range(photo_count):
+            try:
+                photo_object = self._get_provider_photo_object(photo_index)
+            except IndexError:
+                # Photos have been deleted while syncing, so the list has
+                # come up short. The next sync will pick up the new count.
+                logger.debug("Photo list ended early, at %d photos" % photo_index)
+                self.photo_index.set_count(photo_index)
+                break
+            if photo_object != self.photo_index.get(photo_index):
+                changed.append((photo_index, photo_object))
+                # Make sure the info worker picks up the change
+                self.cached_photo_objects.pop(photo_index, None)
+
+            # Write changes in batches, so they're available straight away
+            if len(changed) >= 100:
+                self.photo_index.put(changed)
+                changed = []
+        self.photo_index.put(changed)
+        logger.debug("Photo index synced")
+
+    def _get_prefetch_objects(self):
+        """Return the photo objects for the next few photos in the list"""
+        photo_objects = []
+        if self.offline:
+            # Cached photos load quickly enough without prefetching
+            return photo_objects
+        last = min(self.current_photo_number + self.prefetch,
+                   len(self.shuffled_photos) - 1)
+        for photo_number in range(self.current_photo_number + 1, last + 1):
+            # Give up if another photo has been requested in the meantime
+            if not self._info_queue.empty():
+                break
+            photo_objects.append(self._get_photo_object_at(photo_number))
+        return photo_objects
+
+    def _is_loaded(self, photo_object):
+        with self._surface_lock:
+            return self.get_photo_id(photo_object) in self._surfaces
+
+    def _get_surface(self, photo_object):
+        """Return the loaded photo, held for the caller, or None"""
+        with self._surface_lock:
+            image = self._surfaces.get(self.get_photo_id(photo_object))
+            if image is not None:
+                self._surface_holds[image] += 1
+            return image
+
+    def _load_surface(self, photo_object):
+        """
+        Load a photo, keeping it around in case it's needed again soon.
+        The surface is held for the caller, as with get_photo_cached().
+        """
+        image = self.get_photo_cached(photo_object)
+        if (self.prefetch or self.history) and not self.offline:
+            with self._surface_lock:
+                photo_id = self.get_photo_id(photo_object)
+                if photo_id in self._surfaces:
+                    self._drop_hold(self._surfaces[photo_id])
+                self._surfaces[photo_id] = image
+                self._surface_holds[image] += 1
+        return image
+
+    def _new_surface(self):
+        """
+        Return a surface to draw a photo into, held for the caller. One from
+        the pool is reused if it's been released by everything that held it.
+        """
+        with self._surface_lock:
+            for surface in self._surface_pool:
+                if surface not in self._surface_holds:
+                    break
             else:
-                photo_object = self.get_photo_object(photo_index)
-                self.cached_photo_objects[photo_index] = photo_object
+                surface = imaging.new_surface((self.width, self.height))
+                if len(self._surface_pool) < self._surface_pool_size:
+                    self._surface_pool.append(surface)
+            self._surface_holds[surface] = 1
+            return surface
 
-            # Get the (cached) photo
-            # The photo file will be returned through a "photo" event
-            self.get_photo_cached(photo_object)
+    def release_surface(self, image):
+        """
+        Called once a photo's surface has been drawn (or kept a copy of),
+        so it can be reused for another photo. Each "preview" and "photo"
+        event's image must be released once.
+        """
+        with self._surface_lock:
+            self._drop_hold(image)
 
-        except Exception as error:
-            if photo_object:
-                error = "Photo ID '%s': %s" % (self.get_photo_id(photo_object),
-                                               error)
-            pygame.event.post(self._create_event("error", error=error))
+    def _drop_hold(self, image):
+        """Call with the surface lock held"""
+        holds = self._surface_holds.get(image)
+        if holds is None:
+            # Not one of ours
+            return
+        if holds > 1:
+            self._surface_holds[image] = holds - 1
+        else:
+            del self._surface_holds[image]
+
+    def _trim_surfaces(self):
+        """Forget loaded photos that are outside the prefetch/history window"""
+        first = max(self.current_photo_number - self.history, 0)
+        last = min(self.current_photo_number + self.prefetch,
+                   len(self.shuffled_photos) - 1)
+        if self.offline:
+            last = first - 1
+        keep_ids = set()
+        for photo_number in range(first, last + 1):
+            photo_index = self.shuffled_photos[photo_number]
+            photo_object = self.cached_photo_objects.get(photo_index)
+            if photo_object is not None:
+                keep_ids.add(self.get_photo_id(photo_object))
+
+        with self._surface_lock:
+            for photo_id in self._surfaces.keys():
+                if photo_id not in keep_ids:
+                    self._drop_hold(self._surfaces.pop(photo_id))
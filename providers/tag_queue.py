@@ -0,0 +1,192 @@
+import os
+import json
+import time
+import logging
+import threading
+
+logger = logging.getLogger("Raspberry Frame")
+
+# Delay before retrying a failed update to a photo, doubling on each failure
+RETRY_SECONDS = 10
+MAX_RETRY_SECONDS = 10 * 60
+
+class TagQueue:
+    """
+    Write-behind queue for tag changes. Changes are sent to the provider on
+    a worker thread, retrying until they succeed. Each photo backs off on
+    its own, so one failing photo doesn't hold up the rest, and changes
+    that can never succeed (eg. the photo has been deleted) are dropped.
+    Changes to the same tag are coalesced, and any pending changes are
+    saved to disk so they survive restarts.
+
+    All the disk writes happen on the worker thread, so queueing a change
+    never blocks.
+    """
+    def __init__(self, update_tags, state_file, save_tags=None, is_permanent_error=None):
+        """
+        update_tags: Called as update_tags(photo_id, tags_add, tags_remove)
+                     to send changes to the provider
+        state_file: File to save pending changes to
+        save_tags: Called as save_tags(photo_id, tags) to store a photo's
+                   new tag list locally
+        is_permanent_error: Called with the error when an update fails,
+                            returns True if retrying won't help
+        """
+        self._update_tags = update_tags
+        self.state_file = state_file
+        self._save_tags = save_tags
+        self._is_permanent_error = is_permanent_error
+        self._condition = threading.Condition()
+        # {photo_id: {tag: [tagged before the changes, tagged now]}}
+        self._pending = {}
+        # {photo_id: (time to retry at, delay before the next retry)}
+        self._retries = {}
+        # Local writes waiting for the worker
+        self._tags_to_save = {}
+        self._unsaved = False
+        self._load()
+
+        thread = threading.Thread(target=self._worker)
+        thread.daemon = True
+        thread.start()
+
+    def put(self, photo_id, tag, tagged_before, tagged, tags=None):
+        """
+        Queue a change to a photo's tag. If given, tags is the photo's new
+        tag list, to pass to save_tags.
+        """
+        with self._condition:
+            if tags is not None and self._save_tags is not None:
+                self._tags_to_save[photo_id] = list(tags)
+            changes = self._pending.setdefault(photo_id, {})
+            if tag in changes:
+                tagged_before = changes[tag][0]
+            if tagged == tagged_before:
+                # Toggled back before it was sent - nothing to do
+                changes.pop(tag, None)
+                if not changes:
+                    del self._pending[photo_id]
+            else:
+                changes[tag] = [tagged_before, tagged]
+            self._unsaved = True
+            self._condition.notify()
+
+    def apply(self, photo_id, tags):
+        """Return the tag list with any pending changes applied"""
+        with self._condition:
+            changes = self._pending.get(photo_id, {})
+            tags = [tag for tag in tags
+                    if tag not in changes or changes[tag][1]]
+            tags += [tag for tag in changes
+                     if changes[tag][1] and tag not in tags]
+        return tags
+
+    def _worker(self):
+        while True:
+            with self._condition:
+                # Local writes come first, as they're quick
+                while not (self._tags_to_save or self._unsaved):
+                    photo_id, wait_seconds = self._next_photo()
+                    if photo_id is not None:
+                        break
+                    self._condition.wait(wait_seconds)
+                tags_to_save = self._tags_to_save
+                self._tags_to_save = {}
+                state = None
+                if self._unsaved:
+                    state = json.dumps(self._pending)
+                    self._unsaved = False
+
+            if tags_to_save or state is not None:
+                self._save_local(tags_to_save, state)
+            else:
+                self._send(photo_id)
+
+    def _next_photo(self):
+        """
+        Return (photo ID, None) for the photo to send next, or (None, seconds)
+        if all the pending photos are waiting to be retried. Photos that have
+        been waiting the longest go first, so failing photos take turns with
+        the rest. Call with the condition held.
+        """
+        if not self._pending:
+            return None, None
+        now = time.time()
+        retry_at, photo_id = min((self._retries.get(pending_id, (0, 0))[0], pending_id)
+                                 for pending_id in self._pending)
+        if retry_at > now:
+            return None, retry_at - now
+        return photo_id, None
+
+    def _send(self, photo_id):
+        with self._condition:
+            if photo_id not in self._pending:
+                return
+            changes = dict((tag, list(change)) for tag, change in
+                           self._pending[photo_id].items())
+
+        tags_add = [tag for tag, change in changes.items() if change[1]]
+        tags_remove = [tag for tag, change in changes.items() if not change[1]]
+        try:
+            logger.debug("Updating tags for photo %s..." % photo_id)
+            self._update_tags(photo_id, tags_add, tags_remove)
+        except Exception as error:
+            if self._is_permanent_error is not None and self._is_permanent_error(error):
+                logger.error("Could not update tags for photo %s, dropping the changes: %s" %
+                             (photo_id, error))
+                with self._condition:
+                    self._pending.pop(photo_id, None)
+                    self._retries.pop(photo_id, None)
+                    self._unsaved = True
+                return
+
+            with self._condition:
+                retry_seconds = self._retries.get(photo_id, (0, RETRY_SECONDS))[1]
+                self._retries[photo_id] = (time.time() + retry_seconds,
+                                           min(retry_seconds * 2, MAX_RETRY_SECONDS))
+            logger.error("Could not update tags for photo %s, retrying in %ds: %s" %
+                         (photo_id, retry_seconds, error))
+            return
+
+        with self._condition:
+            self._retries.pop(photo_id, None)
+            pending = self._pending.setdefault(photo_id, {})
+            for tag, change in changes.items():
+                if tag not in pending:
+                    # Toggled back while we were sending,
+                    # so the change needs undoing
+                    pending[tag] = [change[1], change[0]]
+                elif pending[tag][1] == change[1]:
+                    del pending[tag]
+                else:
+                    # The provider now has the state we sent
+                    pending[tag][0] = change[1]
+            if not pending:
+                del self._pending[photo_id]
+            self._unsaved = True
+
+    def _save_local(self, tags_to_save, state):
+        """Store new tag lists, and the pending changes if they've changed"""
+        for photo_id, tags in tags_to_save.items():
+            try:
+                self._save_tags(photo_id, tags)
+            except Exception as error:
+                logger.error("Could not save tags for photo %s: %s" % (photo_id, error))
+        if state is not None:
+            temp_file = self.state_file + ".part"
+            try:
+                with open(temp_file, "w") as f:
+                    f.write(state)
+                os.rename(temp_file, self.state_file)
+            except (IOError, OSError) as error:
+                logger.error("Could not save pending tag changes: %s" % error)
+
+    def _load(self):
+        if os.path.exists(self.state_file):
+            try:
+                with open(self.state_file) as f:
+                    self._pending = json.load(f)
+            except ValueError as error:
+                logger.error("Could not load pending tag changes: %s" % error)
+        if self._pending:
+            logger.info("%d photos have tag changes pending" % len(self._pending))
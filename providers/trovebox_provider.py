@@ -1,33 +1,105 @@
-import urllib2
+import time
 import logging
-from cStringIO import StringIO
 from provider import Provider
+from http_pool import ConnectionPool, CONNECTION_ERRORS
+from lru_cache import LRUCache
+from photo_index import PhotoRecord
 import trovebox
+import requests
 
 logger = logging.getLogger("Raspberry Frame")
 
+# Size of the preview shown while the full photo downloads
+PREVIEW_SIZE = (320, 240)
+# Number of photos to fetch metadata for in each API call
+PAGE_SIZE = 100
+# Refetch pages after this long, to pick up new photos and tag changes
+PAGE_EXPIRY_SECONDS = 60 * 60
+# Number of pages of metadata to keep in memory
+MAX_PAGES = 10
+
 class Trovebox(Provider):
     def __init__(self, *args, **kwds):
-        self._trovebox = trovebox.Trovebox()
+        # Uses ~/.config/trovebox/default unless a host is given
+        self._trovebox = trovebox.Trovebox(host=kwds.pop("host", None))
         self._photo_count = None
+        self._pages = LRUCache(MAX_PAGES) # (fetch time, photos), keyed by page index
+        self._http = ConnectionPool(max_connections=2, timeout=30)
         Provider.__init__(self, *args, **kwds)
 
     def get_photo_count(self):
         """Returns the number of photos available to display"""
         # Only do an API call if we don't know what the photo count is
         if self._photo_count is None:
-            self._photo_count = self._trovebox.photos.list(pageSize=1)[0].totalPages
+            self._get_page(0)
         return self._photo_count
 
+    def refresh(self):
+        """Drop the cached pages, and refetch the first to update the photo count"""
+        self._pages.clear()
+        self._get_page(0)
+
+    def ping(self):
+        """Check that Trovebox can be reached"""
+        self._get_page(0)
+
+    def is_offline_error(self, error):
+        # The trovebox library makes its API calls with requests. Its
+        # TroveboxErrors are error statuses, so Trovebox was reached.
+        return isinstance(error, CONNECTION_ERRORS + (requests.ConnectionError,
+                                                      requests.Timeout))
+
+    def is_permanent_error(self, error):
+        # Tags are updated through the trovebox library, which raises
+        # Trovebox404Error if the photo has been deleted
+        return isinstance(error, trovebox.Trovebox404Error)
+
     def get_photo_object(self, photo_index):
         """Given a photo index, return a unique object for that photo"""
-        returnSizes = "%sx%s" % (self.width, self.height)
-        photo_object = self._trovebox.photos.list(pageSize=1,
-                                                  page=photo_index + 1, # First page is p1
-                                                  returnSizes=returnSizes)[0]
+        page_index, offset = divmod(photo_index, PAGE_SIZE)
+        page = self._pages.get(page_index)
+        if page is None or time.time() - page[0] > PAGE_EXPIRY_SECONDS:
+            page = self._get_page(page_index)
+        return page[1][offset]
+
+    def _get_page(self, page_index):
+        """
+        Fetch the metadata for a page of photos in a single API call.
+        Returns a (fetch time, photos) tuple.
+        """
+        logger.debug("Fetching photo page %d..." % page_index)
+        returnSizes = "%sx%s,%sx%s" % ((self.width, self.height) + PREVIEW_SIZE)
+        photos = self._trovebox.photos.list(pageSize=PAGE_SIZE,
+                                            page=page_index + 1, # First page is p1
+                                            returnSizes=returnSizes)
+
         # Keep the photo count up to date, to save API calls
-        self._photo_count = photo_object.totalPages
-        return photo_object
+        if photos:
+            photo_count = photos[0].totalRows
+        elif page_index == 0:
+            photo_count = 0
+        else:
+            # Past the end of the list, which doesn't say how long it is
+            photo_count = self._photo_count
+
+        # If photos have been added or removed, the other pages are stale
+        if photo_count != self._photo_count:
+            self._pages.clear()
+        self._photo_count = photo_count
+        page = (time.time(), [self._get_record(photo) for photo in photos])
+        self._pages[page_index] = page
+        return page
+
+    def _get_record(self, photo):
+        """Keep only the parts of the Trovebox photo object that we need"""
+        fields = photo.get_fields()
+        url = fields["path%dx%d" % (self.width, self.height)]
+        preview_url = fields.get("path%dx%d" % PREVIEW_SIZE)
+        if photo.description:
+            description = photo.description
+        else:
+            description = photo.filenameOriginal
+        return PhotoRecord(photo.id, url, description, list(photo.tags), preview_url)
 
     def get_photo_id(self, photo_object):
         """Given a photo object, return a unique ID for that photo"""
@@ -35,20 +107,24 @@ class Trovebox(Provider):
 
     def get_photo_file(self, photo_object):
         """Given a photo object, return a file handle for the photo"""
-        url = photo_object.get_fields()["path%dx%d" % (self.width, self.height)]
-        return StringIO(urllib2.urlopen(url).read())
+        return self._http.open(photo_object.url)
+
+    def get_preview_file(self, photo_object):
+        """Given a photo object, return a file handle for a small preview"""
+        if photo_object.preview_url is None:
+            return None
+        return self._http.open(photo_object.preview_url)
 
     def get_description(self, photo_object):
-        if photo_object.description:
-            return photo_object.description
-        else:
-            return photo_object.filenameOriginal
+        return photo_object.description
 
     def get_tags(self, photo_object):
         return photo_object.tags
 
-    def add_tag(self, photo_object, tag):
-        photo_object.update(tagsAdd=tag)
-
-    def remove_tag(self, photo_object, tag):
-        photo_object.update(tagsRemove=tag)
+    def update_tags(self, photo_id, tags_add, tags_remove):
+        changes = {}
+        if tags_add:
+            changes["tagsAdd"] = tags_add
+        if tags_remove:
+            changes["tagsRemove"] = tags_remove
+        self._trovebox.photo.update(photo_id, **changes)
@@ -10,52 +10,67 @@ import sgc
 from sgc.locals import *
 
 import display
+import imaging
+import transitions
+import kenburns
 import providers
+from providers.cache_warmer import CacheWarmer
 import themes
 import overlay
 
-# Frame:
-#   p = Provider(shuffle=True)
-#   handle = p.next()
-#   # wait for PhotoInfo(handle) event
-#   # wait for PhotoLoaded(handle) event
-#
-# Provider:
-#   init:
-#     info_queue.push_front(first_five)
-#     info_thread_run()
-#
-#   next:
-#     if info_queue == []:
-#       info_thread_run(req)
-#     info_queue.push_front(req)
-#
-#   info_done:
-#     event(PhotoInfo(handle))
-#     if download_queue == []:
-#       download_thread_run(req)
-#     download_queue.push_front(req)
-#
-#     if info_queue != []:
-#       info_thread_run(info_queue.pop())
-#
-#   download_done:
-#     event(PhotoDownload(handle)
-#     if download_queue != []:
-#       download_thread_run(download_queue.pop())
-
 CACHE_PATH = os.path.expanduser("~/.raspberryframe_cache")
 CACHE_SIZE_MB = 1024 # Limit cache to 1GB
 
+# How often to check for input when there's no input device to watch
+INPUT_POLL_MS = 250
+# Passed to pygame.event.peek(), which mishandles being called without types
+EVENT_TYPES = range(pygame.NOEVENT + 1, pygame.NUMEVENTS)
+
 logger = logging.getLogger("Raspberry Frame")
 logger.addHandler(logging.StreamHandler())
 
 class RaspberryFrame(sgc.Simple):
     _can_focus = True
 
-    def __init__(self, surf=None, flags=None, crop_threshold=10, **kwargs):
+    def __init__(self, surf=None, flags=None, crop_threshold=10, scaler="auto",
+                 transition=None, transition_ms=1000, kenburns_zoom=None,
+                 kenburns_ms=30000, fps=30, **kwargs):
         sgc.Simple.__init__(self, surf, flags, **kwargs)
         self.crop_threshold = crop_threshold
+        self.scaler = scaler
+        self._transitioning = False
+        self._panning = False
+
+        # Match the display's pixel format, so blits don't need converting
+        self._images["image"] = self._images["image"].convert()
+        self._switch()
+
+        # The frame's buffers are all allocated here, once, and photos are
+        # scaled and drawn straight into them, so showing a photo doesn't
+        # allocate anything
+        self.transition = None
+        if transition:
+            self.transition = transitions.TRANSITIONS[transition](transition_ms, fps)
+            # The photos either side of the transition
+            self._old_image = self.image.copy()
+            self._new_image = self.image.copy()
+
+        # Photos are shown at photo_size, which is larger with Ken Burns
+        self.kenburns = None
+        self.kenburns_ms = kenburns_ms
+        self.photo_size = self.image.get_size()
+        if kenburns_zoom:
+            self.kenburns = kenburns.KenBurns(self.photo_size, kenburns_zoom, fps)
+            self.photo_size = self.kenburns.source_size
+            # Ken Burns keeps the photo, so it needs its own copy of any
+            # photo that has to be fitted first
+            self._fitted = imaging.new_surface(self.photo_size)
+
+        # Called with each photo passed to show_image() once the frame has
+        # finished with it, so its surface can be reused
+        self.release_image = None
+        # The photo Ken Burns is panning over, which it hasn't finished with
+        self._kept_image = None
 
     def _event(self, event):
         if event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
@@ -65,63 +80,166 @@ class RaspberryFrame(sgc.Simple):
     def on_click(self):
         pygame.event.post(self._create_event("click"))
 
-    def show_image(self, image):
-        image = self._letterbox(image)
-
-        self.image.fill(pygame.Color("BLACK"))
-        self.image.blit(image, self._centre_offset(image))
-
-    def _letterbox(self, image):
-        width, height = image.get_size()
-
-        width_scale_factor = 1.0 * width / self.image.get_width()
-        height_scale_factor = 1.0 * height / self.image.get_height()
-
-        # Use the largest scale factor, to prevent cropping
-        scale_factor = max(width_scale_factor, height_scale_factor)
-
-        # If the difference in aspect ratios is less than aspect_error,
-        # crop the image instead of letterboxing
-        aspect_error = abs((width_scale_factor - height_scale_factor) /
-                           max(width_scale_factor, height_scale_factor))
-        if aspect_error <= self.crop_threshold / 100.0:
-            scale_factor = min(width_scale_factor, height_scale_factor)
-
-        new_width = int(width / scale_factor)
-        new_height = int(height / scale_factor)
-
-        return pygame.transform.scale(image, (int(width / scale_factor),
-                                              int(height / scale_factor)))
-
-    def _centre_offset(self, image):
-        width, height = image.get_size()
-        return ((self.image.get_width() / 2 - width / 2),
-                (self.image.get_height() / 2 - height / 2))
+    def show_image(self, image, transition=True):
+        """
+        Show a photo. It's passed to release_image straight away, as it's
+        copied into the frame's buffers, unless Ken Burns is panning over it,
+        in which case it's released when the next photo replaces it.
+        """
+        self._show_image(image, transition)
+        if image is not self._kept_image:
+            self._release(image)
+
+    def _show_image(self, image, transition):
+        if self.kenburns is not None:
+            # Photos from the provider have already been fitted to photo_size
+            photo = image
+            if image.get_size() != self.photo_size:
+                image = self._fit(image, self._fitted)
+            if transition or self.kenburns.source is None:
+                self.kenburns.start(image, self.kenburns_ms)
+            else:
+                self.kenburns.replace_source(image)
+            self._panning = True
+            # Ken Burns has finished with the photo it was panning over
+            self._release(self._kept_image)
+            self._kept_image = photo if image is photo else None
+
+        if self.transition is None or not transition:
+            self._transitioning = False
+            if self._panning:
+                self._panning = not self.kenburns.step(self.image, 0)
+            else:
+                self._fit(image, self.image)
+            self._animating = self._panning
+            self._dirty = True
+            return
+
+        # Start from whatever is on screen, even if it's mid-transition.
+        # Ken Burns waits on its first frame until the transition is over.
+        self._old_image.blit(self.image, (0, 0))
+        if self._panning:
+            self.kenburns.step(self._new_image, 0)
+        else:
+            self._fit(image, self._new_image)
+        self.transition.start()
+        self._transitioning = True
+        self._animating = True
+
+    def _release(self, image):
+        if image is not None and self.release_image is not None:
+            self.release_image(image)
+
+    def _fit(self, image, dest):
+        """Draw the image into dest, fitting it first if it needs it"""
+        if image.get_size() != dest.get_size():
+            return imaging.fit(image, dest.get_size(), self.crop_threshold,
+                               self.scaler, dest)
+        dest.blit(image, (0, 0))
+        return dest
+
+    def update(self, time):
+        if self._transitioning:
+            self._transitioning = not self.transition.step(self.image, self._old_image,
+                                                           self._new_image, time)
+        elif self._panning:
+            self._panning = not self.kenburns.step(self.image, time)
+        else:
+            return
+        self._animating = self._transitioning or self._panning
+        self._dirty = True
 
 ############################################################
 
 class Main:
-    def __init__(self, slide_seconds, width=None, height=None, crop_threshold=10, shuffle=True):
+    def __init__(self, slide_seconds, width=None, height=None, crop_threshold=10, shuffle=True,
+                 prefetch=2, history=2, render_cache_mb=0, scaler="auto", transition=None,
+                 transition_ms=1000, kenburns_zoom=None, fps=30, provider="trovebox",
+                 **provider_options):
         self.screen, self.width, self.height = display.init(width, height)
 
-        self.provider = providers.Provider(self.width, self.height, CACHE_PATH, CACHE_SIZE_MB, shuffle=shuffle)
-        self.theme = themes.Theme(self.width, self.height)
-
-        self.frame = RaspberryFrame((self.width, self.height), crop_threshold)
+        self.frame = RaspberryFrame((self.width, self.height), crop_threshold=crop_threshold,
+                                    scaler=scaler, transition=transition,
+                                    transition_ms=transition_ms, kenburns_zoom=kenburns_zoom,
+                                    kenburns_ms=slide_seconds * 1000, fps=fps)
         self.frame.add(fade=False)
 
+        provider_class = providers.get_provider(provider)
+        photo_width, photo_height = self.frame.photo_size
+        self.provider = provider_class(photo_width, photo_height, CACHE_PATH, CACHE_SIZE_MB,
+                                       crop_threshold=crop_threshold, shuffle=shuffle,
+                                       prefetch=prefetch, history=history,
+                                       render_cache_mb=render_cache_mb, scaler=scaler,
+                                       **provider_options)
+        self.frame.release_image = self.provider.release_surface
+        self.theme = themes.Theme(self.width, self.height)
+
         self.clock = pygame.time.Clock()
         self.slide_seconds = slide_seconds
         self.timer = None
+        self.frame_timer = None
+        self.frame_ms = 1000 / fps
+        self.animating = False
+        self.photo_object = None
 
         self.overlay = overlay.Overlay(self.theme)
 
     def run(self):
-        gobject.idle_add(self.pygame_loop_cb)
+        # Frames are only drawn when something happens, rather than polling
+        self._wakeup_read, self._wakeup_write = os.pipe()
+        gobject.io_add_watch(self._wakeup_read, gobject.IO_IN, self.wakeup_cb)
+        self.provider.event_callback = self.wakeup
+        self.watch_input()
+
+        self.request_frame()
         self.slideshow_next_cb()
         self.start_slideshow()
         gobject.MainLoop().run()
 
+    def watch_input(self):
+        """Wake up when the touchscreen is touched"""
+        device = os.getenv("TSLIB_TSDEVICE") or os.getenv("SDL_MOUSEDEV")
+        if device and not os.getenv("DISPLAY"):
+            try:
+                fd = os.open(device, os.O_RDONLY | os.O_NONBLOCK)
+            except OSError as error:
+                logger.debug("Could not watch %s: %s" % (device, error))
+            else:
+                gobject.io_add_watch(fd, gobject.IO_IN, self.input_cb)
+                return
+        # SDL doesn't say when it has events waiting, so check now and again
+        gobject.timeout_add(INPUT_POLL_MS, self.input_poll_cb)
+
+    def wakeup(self):
+        """Wake up the main loop. Can be called from any thread."""
+        os.write(self._wakeup_write, "x")
+
+    def wakeup_cb(self, fd, condition):
+        os.read(fd, 4096)
+        self.request_frame()
+        return True
+
+    def input_cb(self, fd, condition):
+        # SDL reads the events itself, this is just the signal to look
+        try:
+            while os.read(fd, 4096):
+                pass
+        except OSError:
+            pass
+        self.request_frame()
+        return True
+
+    def input_poll_cb(self):
+        pygame.event.pump()
+        if pygame.event.peek(EVENT_TYPES):
+            self.request_frame()
+        return True
+
+    def request_frame(self):
+        """Handle events and draw a frame, if one isn't already on the way"""
+        if self.frame_timer is None:
+            self.frame_timer = gobject.idle_add(self.pygame_loop_cb)
+
     def start_slideshow(self):
         self.timer = gobject.timeout_add(self.slide_seconds*1000, self.slideshow_next_cb)
 
@@ -130,9 +248,9 @@ class Main:
             gobject.source_remove(self.timer)
         self.timer = None
 
-    def show_image(self, image):
+    def show_image(self, image, transition=True):
         """Show an image and restart the slideshow timer"""
-        self.frame.show_image(image)
+        self.frame.show_image(image, transition)
         if self.timer:
             self.stop_slideshow()
             self.start_slideshow()
@@ -165,14 +283,21 @@ class Main:
             self.provider.add_tag(self.photo_object, self.provider.REMOVE_TAG)
         self.update_overlay()
 
+    def is_current(self, photo_object):
+        """Return True if the photo is the one being shown"""
+        return (self.photo_object is not None and
+                self.provider.get_photo_id(photo_object) ==
+                self.provider.get_photo_id(self.photo_object))
+
     def slideshow_next_cb(self):
         self.provider.next_photo(+1)
         return False
 
     def pygame_loop_cb(self):
-        time = self.clock.tick(30)
-        sgc.update(time)
-        pygame.display.flip()
+        time = self.clock.tick()
+        if not self.animating:
+            # Don't count the time spent idle
+            time = 0
 
         for event in pygame.event.get():
             sgc.event(event)
@@ -181,8 +306,11 @@ class Main:
                 sys.exit()
 
             elif event.type == self.provider.PROVIDER_EVENT:
-                if event.name == "photo":
-                    self.show_image(event.image)
+                # A preview is shown while the full photo downloads
+                if event.name in ("preview", "photo"):
+                    # Don't transition from a photo's preview to the photo
+                    self.show_image(event.image,
+                                    transition=not self.is_current(event.photo_object))
                     self.photo_object = event.photo_object
                     self.update_overlay()
                     logger.debug(self.photo_object)
@@ -210,11 +338,43 @@ class Main:
                 elif event.widget == self.overlay.forward_button:
                     self.provider.next_photo(+1)
 
-        return True
+        # Only send the parts of the screen that have changed to the display
+        dirty = sgc.update(time)
+        if dirty:
+            pygame.display.update(dirty)
+
+        # Keep drawing frames while anything is moving, or events are waiting
+        self.animating = sgc.animating()
+        if self.animating:
+            self.frame_timer = gobject.timeout_add(self.frame_ms, self.pygame_loop_cb)
+        elif pygame.event.peek(EVENT_TYPES):
+            self.frame_timer = gobject.idle_add(self.pygame_loop_cb)
+        else:
+            self.frame_timer = None
+        return False
+
 
+def warm_cache(width=None, height=None, workers=2, kenburns_zoom=None, provider="trovebox",
+               **provider_options):
+    """
+    Fill the cache, without starting the slideshow.
+    Returns False if the photo list couldn't be fetched.
+    """
+    if not (width and height):
+        width, height = display.get_size()
+    if kenburns_zoom:
+        # Render photos at the size the slideshow will ask for
+        width, height = kenburns.source_size((width, height), kenburns_zoom)
+    provider_class = providers.get_provider(provider)
+    provider = provider_class(width, height, CACHE_PATH, CACHE_SIZE_MB, **provider_options)
+    return CacheWarmer(provider, workers, render=True).run()
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Plays a Trovebox slideshow to a framebuffer.")
+    parser.add_argument("--provider", choices=providers.PROVIDERS, default="trovebox",
+                        help="Where to get photos from (default:trovebox)")
+    parser.add_argument("--photo-dir",
+                        help="Photo directory to use with the local provider")
     parser.add_argument("-t", "--slide_seconds", type=int, default=30,
                         help="Delay between slides in seconds (default:30)")
     parser.add_argument("-s", "--size", default=None,
@@ -223,10 +383,34 @@ if __name__ == "__main__":
                         help="Crop the photo if the photo/screen aspect ratios are within this percentage")
     parser.add_argument("-n", "--no-shuffle", action="store_true",
                         help="Disable shuffle")
+    parser.add_argument("-p", "--prefetch", type=int, default=2,
+                        help="Number of upcoming photos to load in advance (default:2)")
+    parser.add_argument("--history", type=int, default=2,
+                        help="Number of previous photos to keep loaded (default:2)")
+    parser.add_argument("--render-cache-mb", type=int, default=0,
+                        help="Size of the cache of photos already scaled to the screen, in MB (default:0, disabled)")
+    parser.add_argument("--scaler", choices=("auto",) + imaging.SCALERS, default="auto",
+                        help="How to scale photos to the screen, from fastest to smoothest "
+                             "(default:auto, the smoothest that's fast enough)")
+    parser.add_argument("--transition", choices=sorted(transitions.TRANSITIONS),
+                        help="How to change from one photo to the next (default:cut)")
+    parser.add_argument("--transition-ms", type=int, default=1000,
+                        help="How long transitions take in ms (default:1000)")
+    parser.add_argument("--kenburns", type=float, nargs="?", const=1.2, metavar="ZOOM",
+                        help="Slowly pan and zoom across photos, by up to ZOOM times (default:1.2)")
+    parser.add_argument("--fps", type=int, default=30,
+                        help="Frame rate for transitions, fades and Ken Burns (default:30)")
+    parser.add_argument("--warm-cache", action="store_true",
+                        help="Download photos into the cache (and render them, if there's a render cache) until it's full, then exit")
+    parser.add_argument("--warm-workers", type=int, default=2,
+                        help="Number of photos to download at once with --warm-cache (default:2)")
     parser.add_argument("-d", "--debug", action="store_true",
                         help="Print additional debug information")
     options = parser.parse_args()
 
+    if options.scaler == "box" and imaging.numpy is None:
+        parser.error("The box scaler needs NumPy to be installed")
+
     if options.debug:
         logger.setLevel(logging.DEBUG)
     else:
@@ -241,9 +425,37 @@ if __name__ == "__main__":
         except ValueError:
             parser.error("Please specify photo size as 'widthxheight'\n(eg: -r 1920x1080)")
 
+    provider_options = {}
+    if options.provider == "local":
+        if not options.photo_dir:
+            parser.error("Please specify a photo directory for the local provider\n(eg: --photo-dir /mnt/photos)")
+        provider_options["photo_dir"] = options.photo_dir
+
+    if options.warm_cache:
+        ok = warm_cache(width=width, height=height,
+                   workers=options.warm_workers,
+                   kenburns_zoom=options.kenburns,
+                   crop_threshold=options.crop_threshold,
+                   shuffle=(not options.no_shuffle),
+                   render_cache_mb=options.render_cache_mb,
+                   scaler=options.scaler,
+                   provider=options.provider,
+                   **provider_options)
+        sys.exit(0 if ok else 1)
+
     Main(slide_seconds=options.slide_seconds,
          width=width, height=height,
          crop_threshold=options.crop_threshold,
-         shuffle=(not options.no_shuffle)).run()
+         shuffle=(not options.no_shuffle),
+         prefetch=options.prefetch,
+         history=options.history,
+         render_cache_mb=options.render_cache_mb,
+         scaler=options.scaler,
+         transition=options.transition,
+         transition_ms=options.transition_ms,
+         kenburns_zoom=options.kenburns,
+         fps=options.fps,
+         provider=options.provider,
+         **provider_options).run()
 
 
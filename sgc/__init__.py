@@ -19,7 +19,7 @@ __version__ = "0.2.1"
 import surface
 import locals
 import widgets
-from widgets._locals import Font, update, event
+from widgets._locals import Font, update, event, animating
 # Import widgets
 from widgets.base_widget import Simple
 from widgets.boxes import VBox, HBox
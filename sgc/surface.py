@@ -32,8 +32,9 @@ class Screen(object):
           size, flags, depth: Arguments for pygame.display.set_mode()
 
         """
-        self.rect = Rect((0,0), size)
         self.image = pygame.display.set_mode(size, flags, depth)
+        # A size of (0,0) opens a window the size of the desktop
+        self.rect = self.image.get_rect()
         self._opengl = flags & OPENGL
         widgets._locals.SCREEN = self
         widgets._locals.Font.set_fonts()
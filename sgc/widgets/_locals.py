@@ -11,6 +11,10 @@ Constants:
 
 get_screen(): Returns the screen object.
 
+widget_changed(): Checks if a widget needs redrawing.
+
+animating(): Checks if any widgets are fading or animating.
+
 """
 
 import pygame.sprite
@@ -33,12 +37,24 @@ get_screen = lambda: SCREEN
 # Cursor queue for set_cursor() and remove_cursor()
 cursors = []
 
+# Widgets drawn to the screen in the last frame
+drawn_widgets = set()
+
 
 
 # ----- EXTERNAL FUNCTIONS -----
 
 def update(time):
-    """Updates all active widgets or modal widgets each frame."""
+    """
+    Updates all active widgets or modal widgets each frame.
+
+    Only the parts of the screen that have changed are redrawn.
+
+    Returns:
+      List of ``pygame.Rect`` areas of the screen that have changed,
+      to pass to ``pygame.display.update()``.
+
+    """
 
     def _fade(widget):
         """Fade widget."""
@@ -92,19 +108,54 @@ def update(time):
 
         glDeleteTextures(tex)
 
+    def extra_images(w):
+        """Return the extra images that are shown."""
+        return [img for img in map(lambda x: w._images[x], w._extra_images)
+                if img._show]
+
     def widget_image(w):
-        """Blit extra images, handle transparency fades and blit to screen."""
-        copy = w.image.copy()
-        # Blit extra images onto copy
-        for img in map(lambda x: w._images[x], w._extra_images):
-            if img._show:
-                copy.blit(img.image, img.rect)
-        # Blend transparent surface when fading and blit to screen.
+        """
+        Return the widget's image with extra images and transparency
+        fades applied. The widget's own image is returned when possible,
+        otherwise a surface cached on the widget is reused.
+
+        """
+        extras = extra_images(w)
+        if w._fade is None and not extras:
+            w._composite = None
+            return w.image
+
+        composite = w._composite
+        if (composite is None or composite.get_size() != w.image.get_size() or
+            composite.get_flags() != w.image.get_flags()):
+            composite = w._composite = w.image.copy()
+        else:
+            # Copy the pixels exactly, ignoring any alpha
+            composite.fill((0,0,0,0))
+            composite.blit(w.image, (0,0), special_flags=BLEND_RGBA_ADD)
+        composite.set_alpha(w.image.get_alpha())
+        for img in extras:
+            composite.blit(img.image, img.rect)
+        # Blend transparency when fading
         if w._fade is not None:
-            transparent = pygame.surface.Surface(w.rect.size, SRCALPHA)
-            transparent.fill((255,255,255, w._fade))
-            copy.blit(transparent, (0,0), special_flags=BLEND_RGBA_MULT)
-        return copy
+            composite.fill((255,255,255, w._fade), special_flags=BLEND_RGBA_MULT)
+        return composite
+
+    def draw_widget(w, clip):
+        """Blit widget and extra images straight to the screen."""
+        if w._fade is not None:
+            # Extra images need to fade along with the widget
+            SCREEN.blit(widget_image(w), w.rect)
+            return
+        w._composite = None
+        SCREEN.blit(w.image, w.rect)
+        extras = extra_images(w)
+        if extras:
+            # Extra images are cut off at the edge of the widget
+            SCREEN.set_clip(clip.clip(w.rect))
+            for img in extras:
+                SCREEN.blit(img.image, img.rect.move(w.rect.topleft))
+            SCREEN.set_clip(clip)
 
     if SCREEN._opengl:
         glMatrixMode(GL_PROJECTION)
@@ -124,27 +175,89 @@ def update(time):
     active_widgets.update(time)
     for widget in active_widgets:
         _fade(widget)
-    for w in active_widgets:
-        copy = widget_image(w)
-        if not SCREEN._opengl:
-            SCREEN.blit(copy, w.rect)
-        else:
-            draw_opengl(copy, w.rect, w._fade)
 
     # Update layered widgets
     layer_widgets.update(time)
     for widget in layer_widgets:
         _fade(widget)
-    for w in layer_widgets:
-        copy = widget_image(w)
-        if not SCREEN._opengl:
-            SCREEN.blit(copy, w.rect)
-        else:
-            draw_opengl(copy, w.rect, w._fade)
+
+    # Layered widgets are drawn on top
+    widgets = active_widgets.sprites() + layer_widgets.sprites()
 
     if SCREEN._opengl:
+        for w in widgets:
+            draw_opengl(widget_image(w), w.rect, w._fade)
         glDisable(GL_SCISSOR_TEST)
         glPopMatrix()
+        return [SCREEN.rect]
+
+    # Find the areas that have changed, including where widgets used to be
+    dirty = []
+    for w in widgets:
+        old_state = w._drawn_state
+        if widget_changed(w):
+            dirty.append(Rect(w.rect))
+            if old_state is not None and old_state[1] != tuple(w.rect):
+                dirty.append(Rect(old_state[1]))
+    for w in drawn_widgets.difference(widgets):
+        dirty.append(Rect(w._drawn_state[1]))
+        w._drawn_state = None
+    drawn_widgets.clear()
+    drawn_widgets.update(widgets)
+
+    # Redraw everything that overlaps each changed area
+    dirty = _merge_rects([r.clip(SCREEN.rect) for r in dirty])
+    for rect in dirty:
+        SCREEN.set_clip(rect)
+        for w in widgets:
+            if w.rect.colliderect(rect):
+                draw_widget(w, rect)
+    SCREEN.set_clip(None)
+    return dirty
+
+def animating():
+    """
+    Return True if any widgets are fading or animating, so update() needs
+    calling again to draw the next frame.
+
+    """
+    for w in active_widgets.sprites() + layer_widgets.sprites():
+        if w._fade is not None or w._animating:
+            return True
+    return False
+
+def widget_changed(widget):
+    """
+    Return True if the widget looks different since the last time this
+    was called for it, because its image has been switched or marked
+    dirty, or it has moved or is fading.
+
+    """
+    extra = tuple((img.image, tuple(img.rect), img._show) for img in
+                  map(lambda x: widget._images[x], widget._extra_images))
+    state = (widget.image, tuple(widget.rect), widget._fade, extra)
+    # Surfaces compare by identity, so a switched image is a change
+    changed = widget._dirty or state != widget._drawn_state
+    widget._dirty = False
+    widget._drawn_state = state
+    return changed
+
+def _merge_rects(rects):
+    """Combine overlapping rects, so no area is redrawn twice."""
+    merged = []
+    for rect in rects:
+        if not rect.w or not rect.h:
+            continue
+        # Keep merging until the rect doesn't overlap any others
+        i = 0
+        while i < len(merged):
+            if merged[i].colliderect(rect):
+                rect = rect.union(merged.pop(i))
+                i = 0
+            else:
+                i += 1
+        merged.append(rect)
+    return merged
 
 def event(event):
     """Send event to focused widget and handle widget focus."""
@@ -45,6 +45,10 @@ class Simple(pygame.sprite.Sprite):
     _settings_default = {}
 
     _fade = None  # Alpha level when fading
+    _dirty = False  # Set after drawing on self.image, to redraw it on screen
+    _drawn_state = None  # How the widget looked when last drawn
+    _composite = None  # Reused to draw the widget when fading
+    _animating = False  # Set while the widget changes every frame
     _fade_up = True
     _fade_delay = 1
     _custom_image = False
@@ -11,7 +11,7 @@ import pygame.sprite
 from pygame.locals import *
 
 from _locals import *
-from _locals import Focus
+from _locals import Focus, widget_changed
 from base_widget import Simple
 
 class Container(Simple):
@@ -31,6 +31,7 @@ class Container(Simple):
 
     _focus = None
     _order = None
+    _composed = None  # The image the widgets were last drawn on
 
     def _config(self, **kwargs):
         """
@@ -83,15 +84,23 @@ class Container(Simple):
 
     def update(self, time):
         """Update widgets each frame."""
-        self.image.fill(self._settings["col"])
         self._settings["widgets"].update(time)
+        # Only redraw when a widget has changed, or the image was replaced
+        changed = [w for w in self._settings["widgets"] if widget_changed(w)]
+        if not changed and self.image is self._composed:
+            return
+        self._composed = self.image
+        self._dirty = True
+
+        self.image.fill(self._settings["col"])
         for w in self._settings["widgets"]:
-            copy = w.image.copy()
-            # Blit extra images onto copy
+            self.image.blit(w.image, w.pos)
+            # Blit extra images, cut off at the edge of the widget
+            self.image.set_clip(w.rect)
             for img in map(lambda x: w._images[x], w._extra_images):
                 if img._show:
-                    copy.blit(img.image, img.rect)
-            self.image.blit(copy, w.pos)
+                    self.image.blit(img.image, img.rect.move(w.pos))
+            self.image.set_clip(None)
 
     def _event(self, event):
         """Handle focus and send events to sub-widgets."""
@@ -126,6 +126,7 @@ class Dialog(Simple):
         self._settings["widget"].update(time)
         self.image.blit(self._settings["widget"].image,
                         self._settings["widget"].pos)
+        self._dirty = True
 
     def _event(self, event):
         """Respond to events."""
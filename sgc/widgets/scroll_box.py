@@ -71,6 +71,7 @@ class ScrollBox(Simple):
         self.image.fill((255,255,255,0))
         self.image.blit(self._settings["widget"].image,
                         self._settings["widget"].pos)
+        self._dirty = True
 
         pos = pygame.mouse.get_pos()
         if self._scroll_y is not None:
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+"""
+Measures how quickly the Trovebox provider can deliver photos, by running
+it against a local fake Trovebox server (see fake_trovebox.py).
+"""
+import os
+import sys
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+import pygame
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from providers import trovebox_provider
+from fake_trovebox import FakeTroveboxServer
+
+logger = logging.getLogger("Raspberry Frame")
+logger.addHandler(logging.StreamHandler())
+
+def percentile(values, percent):
+    values = sorted(values)
+    return values[min(int(len(values) * percent / 100.0), len(values) - 1)]
+
+def run(server, options):
+    """
+    Show a number of slides, and return the time taken for each, and the
+    time until a preview was shown for the slides that had one
+    """
+    cache_dir = tempfile.mkdtemp(prefix="raspberryframe_benchmark")
+    try:
+        provider = trovebox_provider.Trovebox(options.width, options.height,
+                                              os.path.join(cache_dir, "cache"),
+                                              options.cache_size_mb,
+                                              prefetch=options.prefetch,
+                                              history=options.history,
+                                              host=server.url)
+        times = []
+        preview_times = []
+        errors = 0
+        start = time.time()
+        for _ in range(options.slides):
+            slide_start = time.time()
+            provider.next_photo(+1)
+            while True:
+                event = pygame.event.wait()
+                if event.type != provider.PROVIDER_EVENT:
+                    continue
+                if event.name != "preview":
+                    break
+                # Uncached photos show a preview first, which still
+                # needs the full photo after it
+                preview_times.append(time.time() - slide_start)
+            if event.name == "photo":
+                times.append(time.time() - slide_start)
+            else:
+                errors += 1
+                logger.debug("Error: %s" % event.error)
+            time.sleep(options.interval)
+        return times, preview_times, errors, time.time() - start
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks the Trovebox provider against a fake Trovebox server.")
+    parser.add_argument("photo_dir",
+                        help="Directory of JPEGs to serve")
+    parser.add_argument("-n", "--slides", type=int, default=50,
+                        help="Number of slides to show (default:50)")
+    parser.add_argument("-s", "--size", default="800x480",
+                        help="Screen size (default:800x480)")
+    parser.add_argument("-i", "--interval", type=float, default=0,
+                        help="Seconds to wait between slides, to give prefetching time to work (default:0)")
+    parser.add_argument("-p", "--prefetch", type=int, default=2,
+                        help="Number of upcoming photos to load in advance (default:2)")
+    parser.add_argument("--history", type=int, default=2,
+                        help="Number of previous photos to keep loaded (default:2)")
+    parser.add_argument("--cache-size-mb", type=int, default=1024,
+                        help="Photo cache size in MB (default:1024)")
+    parser.add_argument("-l", "--latency", type=int, default=0,
+                        help="Server delay before each response in ms (default:0)")
+    parser.add_argument("-b", "--bandwidth", type=int, default=0,
+                        help="Server bandwidth limit per response in KB/s (default:0, unlimited)")
+    parser.add_argument("-e", "--error-rate", type=float, default=0,
+                        help="Percentage of server requests that fail (default:0)")
+    parser.add_argument("-d", "--debug", action="store_true",
+                        help="Print additional debug information")
+    options = parser.parse_args()
+
+    logger.setLevel(logging.DEBUG if options.debug else logging.INFO)
+    try:
+        options.width, options.height = [int(x) for x in options.size.split("x")]
+    except ValueError:
+        parser.error("Please specify screen size as 'widthxheight'\n(eg: -s 800x480)")
+
+    # Decoding needs a display to convert to, but it doesn't need to be visible
+    os.environ["SDL_VIDEODRIVER"] = "dummy"
+    pygame.display.init()
+    pygame.display.set_mode((options.width, options.height))
+
+    server = FakeTroveboxServer(options.photo_dir,
+                                latency=options.latency / 1000.0,
+                                bandwidth=options.bandwidth * 1024,
+                                error_rate=options.error_rate / 100.0)
+    server.start()
+
+    times, preview_times, errors, elapsed = run(server, options)
+    stats = server.stats.as_dict()
+    slides = len(times) + errors
+
+    print "Slides shown:          %d (%d errors)" % (len(times), errors)
+    print "Slides/sec:            %.2f" % (slides / elapsed)
+    if times:
+        print "Time to photo p50:     %.0fms" % (percentile(times, 50) * 1000)
+        print "Time to photo p99:     %.0fms" % (percentile(times, 99) * 1000)
+    if preview_times:
+        print "Previews shown:        %d" % len(preview_times)
+        print "Time to preview p50:   %.0fms" % (percentile(preview_times, 50) * 1000)
+    print "Bytes transferred:     %d" % stats["bytes_sent"]
+    print "API calls per slide:   %.2f" % (float(stats["api_calls"]) / slides)
+    print "Downloads per slide:   %.2f" % (float(stats["photo_requests"]) / slides)
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+"""
+Measures the speed and quality of each of the scaling engines in imaging.py.
+
+The test photos are a smooth gradient with fine random detail added.
+A perfect downscale averages the detail away, leaving the gradient, so
+quality is reported as the PSNR against the gradient alone (higher is
+better). Nearest neighbour keeps the detail as noise, and scores badly.
+"""
+import os
+import sys
+import time
+import argparse
+import pygame
+import numpy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import imaging
+
+SOURCE_SIZES = (("12MP", (4000, 3000)), ("1080p", (1920, 1080)))
+# Amplitude of the random detail
+DETAIL = 48
+
+def gradient(size):
+    """
+    Return the gradient sampled at the pixel centres of the given size,
+    as a (width, height, 3) array. It's the same at every size.
+    """
+    x = (numpy.arange(size[0]) + 0.5) / size[0]
+    y = (numpy.arange(size[1]) + 0.5) / size[1]
+    pixels = numpy.empty((size[0], size[1], 3))
+    pixels[:, :, 0] = DETAIL + x[:, None] * (255 - 2 * DETAIL)
+    pixels[:, :, 1] = DETAIL + y[None, :] * (255 - 2 * DETAIL)
+    pixels[:, :, 2] = 128
+    return pixels
+
+def test_photo(size):
+    pixels = gradient(size)
+    random = numpy.random.RandomState(0)
+    pixels += random.uniform(-DETAIL, DETAIL, pixels.shape)
+    return pygame.surfarray.make_surface(pixels.astype(numpy.uint8))
+
+def psnr(image, reference):
+    # Ignore the edges, where engines differ in how they treat the border
+    pixels = pygame.surfarray.array3d(image)[2:-2, 2:-2].astype(numpy.float64)
+    error = numpy.mean((pixels - reference[2:-2, 2:-2]) ** 2)
+    if error == 0:
+        return float("inf")
+    return 10 * numpy.log10(255.0 ** 2 / error)
+
+def run(scaler, photo, size, repeats):
+    """Return the average time to scale the photo, and the last result"""
+    times = []
+    for _ in range(repeats):
+        start = time.time()
+        result = imaging.scale(photo, size, scaler)
+        times.append(time.time() - start)
+    return sum(times) / len(times), result
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks the photo scaling engines.")
+    parser.add_argument("-s", "--size", default="800x480",
+                        help="Screen size (default:800x480)")
+    parser.add_argument("-r", "--repeats", type=int, default=5,
+                        help="Number of times to scale each photo (default:5)")
+    options = parser.parse_args()
+
+    try:
+        size = tuple(int(x) for x in options.size.split("x"))
+    except ValueError:
+        parser.error("Please specify screen size as 'widthxheight'\n(eg: -s 800x480)")
+
+    scalers = imaging.SCALERS + ("auto",)
+    print "%-8s %-8s %10s %10s" % ("Source", "Scaler", "ms/image", "PSNR (dB)")
+    for source_name, source_size in SOURCE_SIZES:
+        photo = test_photo(source_size)
+        reference = gradient(size)
+        for scaler in scalers:
+            seconds, result = run(scaler, photo, size, options.repeats)
+            print "%-8s %-8s %10.1f %10.1f" % (source_name, scaler, seconds * 1000,
+                                              psnr(result, reference))
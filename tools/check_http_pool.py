@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+"""
+Checks the HTTP connection pool (providers/http_pool.py) against a local
+fake Trovebox server (see fake_trovebox.py): keep-alive connection reuse,
+redirects, error statuses and responses that are only partly read.
+Exits with a non-zero status if any check fails.
+"""
+import os
+import sys
+import shutil
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from providers.http_pool import ConnectionPool, HTTPError, MAX_REDIRECTS
+from fake_trovebox import FakeTroveboxServer
+
+# Large enough that a partly read response is left unread on the socket
+PHOTO_SIZE = 256 * 1024
+
+def check_keep_alive(server, pool, photo):
+    for _ in range(5):
+        assert pool.get(server.url + "/photos/a.jpg") == photo
+    assert server.stats.connections == 1, "%d connections" % server.stats.connections
+
+def check_redirects(server, pool, photo):
+    assert pool.get(server.url + "/redirect/redirect/photos/a.jpg") == photo
+    assert server.stats.connections == 1, "%d connections" % server.stats.connections
+    try:
+        pool.get(server.url + "/redirect" * (MAX_REDIRECTS + 1) + "/photos/a.jpg")
+    except HTTPError as error:
+        assert "Too many redirects" in str(error), error
+    else:
+        raise AssertionError("Redirect loop wasn't stopped")
+
+def check_error_status(server, pool, photo):
+    try:
+        pool.get(server.url + "/photos/missing.jpg")
+    except HTTPError as error:
+        assert error.status == 404, error
+        # Not an IOError, so a missing photo doesn't look like being offline
+        assert not isinstance(error, IOError)
+    else:
+        raise AssertionError("No error for a missing photo")
+    # The error's body was read, so the connection is still usable
+    assert pool.get(server.url + "/photos/a.jpg") == photo
+    assert server.stats.connections == 1, "%d connections" % server.stats.connections
+
+def check_partial_read(server, pool, photo):
+    # A response that's closed early can't be reused...
+    response = pool.open(server.url + "/photos/a.jpg")
+    assert response.read(10) == photo[:10]
+    response.close()
+    assert pool.get(server.url + "/photos/a.jpg") == photo
+    assert server.stats.connections == 2, "%d connections" % server.stats.connections
+
+    # ...but one read to the end in chunks can
+    response = pool.open(server.url + "/photos/a.jpg")
+    chunks = []
+    while True:
+        chunk = response.read(10000)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    response.close()
+    assert "".join(chunks) == photo
+    assert pool.get(server.url + "/photos/a.jpg") == photo
+    assert server.stats.connections == 2, "%d connections" % server.stats.connections
+
+CHECKS = (check_keep_alive, check_redirects, check_error_status, check_partial_read)
+
+if __name__ == "__main__":
+    photo_dir = tempfile.mkdtemp(prefix="raspberryframe_check")
+    failed = 0
+    try:
+        photo = os.urandom(PHOTO_SIZE)
+        with open(os.path.join(photo_dir, "a.jpg"), "wb") as f:
+            f.write(photo)
+        server = FakeTroveboxServer(photo_dir)
+        server.start()
+
+        for check in CHECKS:
+            # A fresh pool each time, so the connection counts start from zero
+            server.stats.reset()
+            try:
+                check(server, ConnectionPool(max_connections=1, timeout=10), photo)
+            except AssertionError as error:
+                print "FAIL %s: %s" % (check.__name__, error)
+                failed += 1
+            else:
+                print "ok   %s" % check.__name__
+    finally:
+        shutil.rmtree(photo_dir, ignore_errors=True)
+    sys.exit(1 if failed else 0)
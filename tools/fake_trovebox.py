@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+"""
+A stand-in Trovebox server, for measuring provider performance without the
+real service. Serves photos/list.json pages and the photos themselves from
+a local directory of JPEGs, with optional latency, bandwidth limit and
+error rate. /redirect/<path> redirects to /<path>.
+"""
+import os
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import threading
+import urlparse
+import SocketServer
+import BaseHTTPServer
+
+logger = logging.getLogger("Fake Trovebox")
+
+CHUNK_SIZE = 16 * 1024
+
+class Stats:
+    """Request counters, shared between request handler threads"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.connections = 0
+            self.api_calls = 0
+            self.photo_requests = 0
+            self.errors = 0
+            self.bytes_sent = 0
+
+    def add(self, **counts):
+        with self._lock:
+            for name, count in counts.items():
+                setattr(self, name, getattr(self, name) + count)
+
+    def as_dict(self):
+        with self._lock:
+            return {"connections": self.connections,
+                    "api_calls": self.api_calls,
+                    "photo_requests": self.photo_requests,
+                    "errors": self.errors,
+                    "bytes_sent": self.bytes_sent}
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    # Allow keep-alive connections
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        self.server.stats.add(connections=1)
+
+    def do_GET(self):
+        server = self.server
+        url = urlparse.urlsplit(self.path)
+        params = dict(urlparse.parse_qsl(url.query))
+
+        if server.latency:
+            time.sleep(server.latency)
+
+        if url.path == "/stats.json":
+            self._send_json(server.stats.as_dict())
+            return
+
+        if url.path.startswith("/redirect/"):
+            # Redirects to the rest of the path, so they can be chained
+            location = url.path[len("/redirect"):]
+            if url.query:
+                location += "?" + url.query
+            self.send_response(302)
+            self.send_header("Location", location)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        if random.random() < server.error_rate:
+            server.stats.add(errors=1)
+            self._send(500, "text/plain", "Injected error")
+            return
+
+        if url.path == "/photos/list.json":
+            server.stats.add(api_calls=1)
+            self._send_json(server.list_photos(params))
+        elif url.path.startswith("/photos/"):
+            server.stats.add(photo_requests=1)
+            name = os.path.basename(url.path)
+            if name not in server.photo_names:
+                self._send(404, "text/plain", "Not found")
+                return
+            with open(os.path.join(server.photo_dir, name), "rb") as f:
+                self._send(200, "image/jpeg", f.read())
+        else:
+            self._send(404, "text/plain", "Not found")
+
+    def do_POST(self):
+        # Accept tag updates (photo/<id>/update.json) without doing anything
+        length = int(self.headers.getheader("content-length") or 0)
+        self.rfile.read(length)
+        self.server.stats.add(api_calls=1)
+        self._send_json({"code": 200, "message": "Photo updated", "result": True})
+
+    def _send_json(self, data):
+        self._send(200, "application/json", json.dumps(data))
+
+    def _send(self, status, content_type, body):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+
+        # Throttle the body to the bandwidth limit
+        for start in range(0, len(body), CHUNK_SIZE):
+            chunk = body[start:start + CHUNK_SIZE]
+            self.wfile.write(chunk)
+            if self.server.bandwidth:
+                time.sleep(float(len(chunk)) / self.server.bandwidth)
+        self.server.stats.add(bytes_sent=len(body))
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+class FakeTroveboxServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, photo_dir, port=0, latency=0, bandwidth=0, error_rate=0):
+        """
+        photo_dir: Directory of JPEGs to serve
+        port: Port to listen on (0 picks a free port)
+        latency: Delay before each response, in seconds
+        bandwidth: Maximum bytes per second for each response (0 for no limit)
+        error_rate: Fraction of requests that fail with a 500 error
+        """
+        BaseHTTPServer.HTTPServer.__init__(self, ("127.0.0.1", port), Handler)
+        self.photo_dir = photo_dir
+        self.photo_names = sorted(name for name in os.listdir(photo_dir)
+                                  if name.lower().endswith((".jpg", ".jpeg")))
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.stats = Stats()
+
+    def handle_error(self, request, client_address):
+        # Clients closing connections early (eg. a partly read photo) is expected
+        logger.debug("Connection from %s:%d closed: %s" %
+                     (client_address + (sys.exc_info()[1],)))
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:%d" % self.server_port
+
+    def start(self):
+        """Serve requests on a background thread"""
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def list_photos(self, params):
+        page_size = int(params.get("pageSize", 20))
+        page = int(params.get("page", 1))
+        total_rows = len(self.photo_names)
+        total_pages = (total_rows + page_size - 1) // page_size
+        sizes = [size for size in params.get("returnSizes", "").split(",") if size]
+
+        result = []
+        first = (page - 1) * page_size
+        for row, name in enumerate(self.photo_names[first:first + page_size]):
+            photo = {"id": os.path.splitext(name)[0],
+                     "description": "",
+                     "filenameOriginal": name,
+                     "tags": [],
+                     "totalRows": total_rows,
+                     "totalPages": total_pages,
+                     "currentPage": page,
+                     "currentRow": first + row + 1}
+            # Every size is served from the original file
+            for size in sizes:
+                photo["path%s" % size] = "%s/photos/%s" % (self.url, name)
+            result.append(photo)
+        if total_rows == 0:
+            result = [{"totalRows": 0, "totalPages": 0}]
+        return {"code": 200, "message": "Photo list", "result": result}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serves a directory of JPEGs as a fake Trovebox server.")
+    parser.add_argument("photo_dir",
+                        help="Directory of JPEGs to serve")
+    parser.add_argument("-p", "--port", type=int, default=8000,
+                        help="Port to listen on (default:8000)")
+    parser.add_argument("-l", "--latency", type=int, default=0,
+                        help="Delay before each response in ms (default:0)")
+    parser.add_argument("-b", "--bandwidth", type=int, default=0,
+                        help="Bandwidth limit per response in KB/s (default:0, unlimited)")
+    parser.add_argument("-e", "--error-rate", type=float, default=0,
+                        help="Percentage of requests that fail (default:0)")
+    parser.add_argument("-d", "--debug", action="store_true",
+                        help="Log every request")
+    options = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if options.debug else logging.INFO)
+    server = FakeTroveboxServer(options.photo_dir, options.port,
+                                latency=options.latency / 1000.0,
+                                bandwidth=options.bandwidth * 1024,
+                                error_rate=options.error_rate / 100.0)
+    logger.info("Serving %d photos at %s" % (len(server.photo_names), server.url))
+    server.serve_forever()
@@ -0,0 +1,90 @@
+import time
+import logging
+
+logger = logging.getLogger("Raspberry Frame")
+
+class Transition:
+    """
+    Draws the frames of a transition from one photo to the next.
+    Progress is taken from the time that has passed, so when frames can't
+    be drawn fast enough they're dropped, rather than slowing it down.
+    """
+    def __init__(self, duration_ms=1000, fps=30):
+        self.duration_ms = duration_ms
+        self.fps = fps
+        self.stats = None
+        self._elapsed = 0
+        self._draw_times = []
+
+    def start(self):
+        self._elapsed = 0
+        self._draw_times = []
+
+    def step(self, surface, old, new, time_ms):
+        """
+        Draw the next frame onto surface, time_ms after the last one.
+        Returns True once the transition has finished.
+        """
+        self._elapsed += time_ms
+        progress = min(float(self._elapsed) / self.duration_ms, 1.0)
+
+        start = time.time()
+        if progress < 1:
+            self.draw(surface, old, new, progress)
+        else:
+            surface.blit(new, (0, 0))
+        self._draw_times.append((time.time() - start) * 1000)
+
+        if progress < 1:
+            return False
+        self._report()
+        return True
+
+    def draw(self, surface, old, new, progress):
+        """Draw a frame of the transition, progress being from 0 to 1"""
+        raise NotImplementedError("This method must be implemented in the transition class")
+
+    def _report(self):
+        draw_times = sorted(self._draw_times)
+        frames = len(draw_times)
+        expected = self.duration_ms * self.fps / 1000
+        self.stats = {"frames": frames,
+                      "dropped": max(expected - frames, 0),
+                      "elapsed_ms": self._elapsed,
+                      "draw_ms_median": draw_times[frames / 2],
+                      "draw_ms_max": draw_times[-1]}
+        logger.debug("%s: %d frames in %dms, %d dropped, draw time median %.1fms, max %.1fms" %
+                     (self.__class__.__name__, frames, self._elapsed,
+                      self.stats["dropped"], self.stats["draw_ms_median"],
+                      self.stats["draw_ms_max"]))
+
+class Crossfade(Transition):
+    """Fade the new photo in over the old one, using surface alpha"""
+    def draw(self, surface, old, new, progress):
+        surface.blit(old, (0, 0))
+        new.set_alpha(int(255 * progress))
+        surface.blit(new, (0, 0))
+        new.set_alpha(None)
+
+class Slide(Transition):
+    """Slide the new photo in from the right, pushing the old one out"""
+    def draw(self, surface, old, new, progress):
+        width, height = surface.get_size()
+        x = int(width * (1 - progress))
+        surface.blit(old, (0, 0), (width - x, 0, x, height))
+        surface.blit(new, (x, 0), (0, 0, width - x, height))
+
+class Wipe(Transition):
+    """Uncover the new photo from left to right"""
+    def start(self):
+        Transition.start(self)
+        self._wiped = 0
+
+    def draw(self, surface, old, new, progress):
+        # The old photo is already there, so only draw the newly wiped strip
+        width, height = surface.get_size()
+        x = int(width * progress)
+        surface.blit(new, (self._wiped, 0), (self._wiped, 0, x - self._wiped, height))
+        self._wiped = x
+
+TRANSITIONS = {"crossfade": Crossfade, "slide": Slide, "wipe": Wipe}